@@ -1,11 +1,71 @@
 from flask import Flask, request, jsonify, render_template
 import json
+import hashlib
+import os
+import re
+import tempfile
+import threading
 import traceback
-from mdp import MDP, Node, Policy
+import uuid
+from urllib.parse import urlencode
+from queue import Full, Queue
+from mdp import MDP, Node, Policy, DTYPES, SOLVERS
+from cache import LRUCache, ModelCache, ModelStore, evict_files
+from jobs import JobQueue, DONE
+from instrumentation import Metrics
+from graph import SolutionGraph, EDGE_FILTERS
+from solutions import SolutionFile, write_solution
 from decimal import Decimal
+import numpy as np
 
 app = Flask(__name__)
 
+# serialized /api/solve responses, keyed by solution_key
+SOLUTION_CACHE_BYTES = 64 * 1024 * 1024
+solution_cache = LRUCache(SOLUTION_CACHE_BYTES)
+
+# graphs of recent solves, served by /api/solutions/<solution_id>/graph. A cached response points at its graph, so
+# it is dropped with it
+SOLUTION_GRAPH_BYTES = 256 * 1024 * 1024
+solution_graphs = LRUCache(SOLUTION_GRAPH_BYTES, on_evict=lambda solution_id, view: solution_cache.discard(solution_id))
+# states per page of the graph endpoint
+GRAPH_PAGE_SIZE = 1000
+GRAPH_MAX_PAGE_SIZE = 10000
+
+# solution files of recent solves for /api/solutions/<solution_id>/lookup, the oldest are removed past
+# SOLUTION_DIR_BYTES. Files written by mdp.py -save can be copied there as <solution_id>.sol
+SOLUTION_DIR = os.path.join(tempfile.gettempdir(), 'mdp-solutions')
+SOLUTION_DIR_BYTES = 1024 * 1024 * 1024
+# open (memory mapped) solution files, counted as one byte each
+OPEN_SOLUTIONS = 256
+open_solutions = LRUCache(OPEN_SOLUTIONS)
+solution_id_pattern = re.compile(r'^[0-9a-f]{32,64}$')
+# solution files are written by a background thread, lookups of a file still in its queue wait this many seconds
+solution_writes = Queue()
+pending_solutions = {}
+solution_writer_lock = threading.Lock()
+solution_writer = None
+SOLUTION_WRITE_WAIT = 30
+
+# compiled models of /api/models, the least recently used are written to MODEL_SPILL_DIR (when set) once the ones
+# in memory pass MODEL_STORE_BYTES, and dropped when the directory passes MODEL_SPILL_BYTES
+MODEL_STORE_BYTES = 512 * 1024 * 1024
+MODEL_SPILL_DIR = None
+MODEL_SPILL_BYTES = None
+model_store = ModelStore(MODEL_STORE_BYTES, MODEL_SPILL_DIR, MODEL_SPILL_BYTES)
+model_id_pattern = re.compile(r'^[0-9a-f]{64}$')
+
+# /api/jobs solves run in their own processes, at most JOB_WORKERS at a time (defaults to the number of CPUs)
+JOB_WORKERS = None
+JOB_QUEUE_LIMIT = 64
+
+# stop flags of the running /api/solve/stream solves, by stream_id
+streams = {}
+streams_lock = threading.Lock()
+
+# totals of the stats of every solve, served on /metrics
+metrics = Metrics()
+
 def convert_json_to_mdp_text(states, transitions):
     """Convert JSON input to text format that mdp.py can parse"""
     lines = []
@@ -30,82 +90,391 @@ def convert_json_to_mdp_text(states, transitions):
     
     return lines
 
+def solution_key(lines, *params):
+    """Canonical hash of a model and the solver parameters. Blank lines, comments and surrounding spaces don't change it"""
+    digest = hashlib.sha256(repr(params).encode())
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            digest.update(line.encode())
+            digest.update(b'\n')
+    return digest.hexdigest()
+
+def solution_result(mdp, solution_id=None, graph=False):
+    """Response body of a solved MDP, with the graph and lookup URLs when there is a solution_id"""
+    result = {
+        'success': True,
+        'policy': {name: str(action) for name, action in mdp.policy.items()},
+        'values': {name: float(node.value) for name, node in mdp.items()},
+        'converged': bool(mdp.converged),
+        'gap': mdp.gap
+    }
+    if solution_id is not None:
+        result['solution_id'] = solution_id
+        result['graph_url'] = f'/api/solutions/{solution_id}/graph'
+        result['lookup_url'] = f'/api/solutions/{solution_id}/lookup'
+    if graph:
+        view = SolutionGraph(mdp)
+        result['graph'] = view.page(view.select())
+    return result
+
+def store_solution(mdp, solution_id):
+    """Keeps the graph of a solved MDP for the graph endpoint and queues its solution file for the lookup endpoint"""
+    global solution_writer
+    view = SolutionGraph(mdp)
+    solution_graphs.put(solution_id, view, view.nbytes)
+    written = threading.Event()
+    with solution_writer_lock:
+        pending_solutions[solution_id] = written
+        if solution_writer is None:
+            solution_writer = threading.Thread(target=write_solutions, daemon=True)
+            solution_writer.start()
+    solution_writes.put((solution_id, mdp, written))
+
+def write_solutions():
+    """Writes the queued solution files, removing the oldest whenever the queue runs empty"""
+    while True:
+        solution_id, mdp, written = solution_writes.get()
+        try:
+            os.makedirs(SOLUTION_DIR, exist_ok=True)
+            write_solution(mdp, os.path.join(SOLUTION_DIR, f'{solution_id}.sol'))
+            if solution_writes.empty():
+                evict_files(SOLUTION_DIR, '.sol', SOLUTION_DIR_BYTES)
+        except Exception:
+            app.logger.exception('Writing the solution file of %s failed', solution_id)
+        finally:
+            with solution_writer_lock:
+                if pending_solutions.get(solution_id) is written:
+                    del pending_solutions[solution_id]
+            written.set()
+
+def open_solution(solution_id):
+    """The SolutionFile of a solution_id, None when there is none"""
+    if not solution_id_pattern.match(solution_id):
+        return None
+    with solution_writer_lock:
+        pending = pending_solutions.get(solution_id)
+    if pending is not None:
+        pending.wait(SOLUTION_WRITE_WAIT)
+    solution = open_solutions.get(solution_id)
+    if solution is None:
+        try:
+            solution = SolutionFile(os.path.join(SOLUTION_DIR, f'{solution_id}.sol'))
+        except (FileNotFoundError, ValueError):
+            return None
+        open_solutions.put(solution_id, solution, 1)
+    return solution
+
+def model_lines(data):
+    """The model of a request, its 'text_input' or else its 'states' and 'transitions'"""
+    if 'text_input' in data and data['text_input'].strip():
+        return data['text_input'].strip().split('\n')
+    # Fallback to JSON parsing (for backwards compatibility)
+    return convert_json_to_mdp_text(data.get('states', {}), data.get('transitions', {}))
+
+def solver_parameters(data):
+    """The solver parameters of a /api/solve request, all its parameters but the model"""
+    discount_factor = float(data.get('discount_factor', 0.9))
+    tolerance = float(data.get('tolerance', 0.01))
+    minimize = bool(data.get('minimize', False))
+    precision = data.get('precision', 'float64')
+    bounds = bool(data.get('bounds', False))
+    solver = data.get('solver', 'vi')
+    k = int(data.get('k', 20))
+    max_iterations = int(data.get('max_iterations', 100))
+    return discount_factor, tolerance, minimize, precision, bounds, solver, k, max_iterations
+
+def requested_solver(data):
+    """The solver a request asks for, the label of its metrics when it fails. Unknown names are counted together"""
+    solver = data.get('solver', 'vi') if isinstance(data, dict) else 'vi'
+    return solver if solver in SOLVERS else 'unknown'
+
+def solve_parameters(data):
+    """The model lines and the solver parameters of a /api/solve request"""
+    return (model_lines(data), *solver_parameters(data))
+
+def solve_model(text_lines, discount_factor, tolerance, minimize, precision, bounds=False, solver='vi', k=20,
+                max_iterations=100, progress=None, compiled=None):
+    """Parses and solves a model, or solves the compiled model of the registry, returns the solved MDP"""
+    # Create MDP instance (only the exact decimal mode needs the parameters as Decimals)
+    if precision == 'decimal':
+        discount_factor, tolerance = Decimal(str(discount_factor)), Decimal(str(tolerance))
+    mdp = MDP(df=discount_factor, tol=tolerance, max_iter=max_iterations, use_min=minimize, precision=precision,
+              solver=solver, bounds=bounds, k=k)
+    if compiled is not None:
+        mdp.load_compiled(compiled)
+    else:
+        MDP.parse_input(mdp, lines=text_lines)
+    
+    # Initialize random policy and apply it
+    mdp.policy = Policy.random_policy(mdp)
+    mdp.apply_policy(mdp.policy)
+     
+    # Solve the MDP
+    mdp.solve(progress)
+    return mdp
+
+def solve_job(data):
+    """Runs a /api/jobs job in its process, the graph is only in the result with include_graph"""
+    mdp = solve_model(*solve_parameters(data))
+    result = solution_result(mdp, graph=bool(data.get('include_graph', False)))
+    result['stats'] = mdp.stats.to_dict()
+    return result
+
+def observe_job(job, data):
+    """Counts the solves of finished jobs in the metrics"""
+    metrics.observe(job['result']['stats'] if job['status'] == DONE else None, solver=requested_solver(data),
+                    success=job['status'] == DONE)
+
+job_queue = JobQueue(solve_job, workers=JOB_WORKERS, max_queued=JOB_QUEUE_LIMIT, on_finish=observe_job)
+
 @app.route('/')
 def index():
     """Serve the main UI page"""
     return render_template('index.html')
 
+def cached_body(key, include_graph):
+    """The cached /api/solve response body of a solution_key, None when the solve has to run"""
+    if include_graph:
+        return None
+    # a cached response points at its graph, it is dropped with it so the request counts as the miss it is
+    if key not in solution_graphs:
+        solution_cache.discard(key)
+    cached = solution_cache.get(key)
+    if cached is not None:
+        # keeps the graphs of popular responses from being evicted
+        solution_graphs.get(key)
+    return cached
+
+def cache_body(key, result):
+    """Caches the /api/solve response body of a solution_key, returns it"""
+    body = app.json.response(result).get_data()
+    solution_cache.put(key, body, len(body))
+    return body
+
+def cached_solve(key, include_graph, solver, solve):
+    """The /api/solve response of a solution_key, from the cache or else from solve()"""
+    cached = cached_body(key, include_graph)
+    if cached is not None:
+        return app.response_class(cached, mimetype='application/json', headers={'X-Cache': 'HIT'})
+    
+    try:
+        mdp = solve()
+    except Exception:
+        metrics.observe(None, solver=solver, success=False)
+        raise
+    metrics.observe(mdp.stats.to_dict(), solver=mdp.solver)
+    store_solution(mdp, key)
+    result = solution_result(mdp, key, include_graph)
+    result['stats'] = mdp.stats.to_dict()
+    
+    if include_graph:
+        response = jsonify(result)
+    else:
+        response = app.response_class(cache_body(key, result), mimetype='application/json')
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
 @app.route('/api/solve', methods=['POST'])
 def solve_mdp():
     """Solve MDP from JSON input"""
     try:
         data = request.json
+        parameters = solve_parameters(data)
+        return cached_solve(solution_key(*parameters), bool(data.get('include_graph', False)), requested_solver(data),
+                            lambda: solve_model(*parameters))
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 400
+
+@app.route('/api/models', methods=['POST'])
+def upload_model():
+    """Parse and compile a model once, returns its model_id"""
+    try:
+        data = request.json
+        precision = data.get('precision', 'float64')
+        if precision not in DTYPES:
+            raise ValueError(f"Stored models need a float precision, expected one of {', '.join(DTYPES)}")
+        text_lines = model_lines(data)
+        model_id = ModelCache.key(solution_key(text_lines).encode(), DTYPES[precision])
+        compiled = model_store.get(model_id)
+        if compiled is None:
+            mdp = MDP(precision=precision)
+            MDP.parse_input(mdp, lines=text_lines)
+            compiled = mdp.compiled or mdp.compile()
+            model_store.put(model_id, compiled)
+        return jsonify({
+            'success': True,
+            'model_id': model_id,
+            'states': len(compiled),
+            'actions': len(compiled.action_target),
+            'precision': precision,
+            'solve_url': f'/api/models/{model_id}/solve'
+        }), 201
         
-        # Extract parameters
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 400
+
+@app.route('/api/models', methods=['GET'])
+def model_store_stats():
+    """Size, hit/miss counters and evictions of the model registry"""
+    return jsonify(model_store.stats())
+
+@app.route('/api/models/<model_id>/solve', methods=['POST'])
+def solve_stored_model(model_id):
+    """Solve a model of POST /api/models with the solver parameters of /api/solve"""
+    compiled = model_store.get(model_id) if model_id_pattern.match(model_id) else None
+    if compiled is None:
+        return jsonify({'success': False, 'error': 'Unknown or evicted model, upload it again'}), 404
+    try:
+        data = request.json or {}
+        parameters = solver_parameters({**data, 'precision': np.dtype(compiled.dtype).name})
+        return cached_solve(solution_key([model_id], *parameters), bool(data.get('include_graph', False)),
+                            requested_solver(data), lambda: solve_model(None, *parameters, compiled=compiled))
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 400
+
+@app.route('/api/solve/stream', methods=['POST'])
+def solve_mdp_stream():
+    """Solve with Server-Sent Events, 'progress' events and then a 'result' or an 'error' event"""
+    data = request.json
+    events = Queue()
+    stopped = threading.Event()
+    rounds = []
+    stream_id = uuid.uuid4().hex
+    with streams_lock:
+        streams[stream_id] = stopped
+    
+    def progress(event):
+        rounds.append(event['iteration'])
+        events.put(('progress', event))
+        return stopped.is_set()
+    
+    def run():
+        try:
+            parameters = solve_parameters(data)
+            key = solution_key(*parameters)
+            include_graph = bool(data.get('include_graph', False))
+            cached = cached_body(key, include_graph)
+            if cached is not None:
+                events.put(('result', json.loads(cached)))
+                return
+            mdp = solve_model(*parameters, progress=progress)
+            # a stopped solve isn't the solution the next request with these parameters asks for
+            solution_id = uuid.uuid4().hex if stopped.is_set() else key
+            store_solution(mdp, solution_id)
+            result = solution_result(mdp, solution_id, include_graph)
+            result['stats'] = mdp.stats.to_dict()
+            metrics.observe(result['stats'], solver=mdp.solver)
+            if not include_graph and not stopped.is_set():
+                cache_body(key, result)
+            result['iterations'] = len(rounds)
+            result['stopped'] = stopped.is_set()
+            events.put(('result', result))
+        except Exception as e:
+            metrics.observe(None, solver=requested_solver(data), success=False)
+            events.put(('error', {'success': False, 'error': str(e)}))
+    
+    def stream():
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                name, body = events.get()
+                yield f'event: {name}\ndata: {json.dumps(body)}\n\n'
+                if name != 'progress':
+                    break
+        finally:
+            # nobody listens any more
+            stopped.set()
+    
+    def forget():
+        with streams_lock:
+            streams.pop(stream_id, None)
+    
+    response = app.response_class(stream(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no',
+                                           'X-Stream-Id': stream_id})
+    response.call_on_close(forget)
+    return response
+
+@app.route('/api/solve/stream/<stream_id>/stop', methods=['POST'])
+def stop_stream(stream_id):
+    """Stops a running /api/solve/stream solve after its current round, the stream still ends with its 'result'"""
+    with streams_lock:
+        stopped = streams.get(stream_id)
+    if stopped is None:
+        return jsonify({'success': False, 'error': 'Unknown or finished stream'}), 404
+    stopped.set()
+    return jsonify({'success': True, 'stream_id': stream_id})
+
+@app.route('/api/solve/incremental', methods=['POST'])
+def solve_mdp_incremental():
+    """Re-solve after a small edit, warm started from a previous solution"""
+    try:
+        data = request.json
         discount_factor = float(data.get('discount_factor', 0.9))
         tolerance = float(data.get('tolerance', 0.01))
-        minimize = data.get('minimize', False)
+        minimize = bool(data.get('minimize', False))
+        changes = data.get('changes', [])
+        if isinstance(changes, str):
+            changes = changes.strip().split('\n')
         
-        # Create MDP instance
-        mdp = MDP(df=Decimal(str(discount_factor)), tol=Decimal(str(tolerance)), use_min=minimize)
+        mdp = MDP(df=discount_factor, tol=tolerance, use_min=minimize, precision=data.get('precision', 'float64'))
+        MDP.parse_input(mdp, lines=data.get('text_input', '').strip().split('\n'))
         
-        # Check if we have raw text input
-        if 'text_input' in data and data['text_input'].strip():
-            # Parse directly from text input
-            text_lines = data['text_input'].strip().split('\n')
-            MDP.parse_input(mdp, lines=text_lines)
-        else:
-            # Fallback to JSON parsing (for backwards compatibility)
-            states = data.get('states', {})
-            transitions = data.get('transitions', {})
-            text_lines = convert_json_to_mdp_text(states, transitions)
-            MDP.parse_input(mdp, lines=text_lines)
-        
-        # Initialize random policy and apply it
-        mdp.policy = Policy.random_policy(mdp)
-        mdp.apply_policy(mdp.policy)
-         
-        # Solve the MDP
-        mdp.solve()
+        # Start from the previous solution, nodes it doesn't know start at 0
+        for name, value in data.get('values', {}).items():
+            if name in mdp:
+                mdp[name].value = mdp.number(value)
+        mdp.policy = Policy({name: action for name, action in data.get('policy', {}).items() if name in mdp})
+        backups = mdp.resolve(changes)
         
-        # Prepare graph data for visualization
-        nodes = []
-        edges = []
+        solution_id = uuid.uuid4().hex
+        store_solution(mdp, solution_id)
+        result = solution_result(mdp, solution_id, bool(data.get('include_graph', False)))
+        result['backups'] = backups
+        return jsonify(result)
         
-        for state_name, node in mdp.items():
-            # Create node data
-            nodes.append({
-                'id': state_name,
-                'name': state_name,
-                'value': float(node.value),
-                'reward': float(node.reward),
-                'type': 'state'
-            })
-            
-            # Create edges for all possible transitions
-            for edge_name, probability in node.edges.items():
-                is_optimal = (mdp.policy.get(state_name) == edge_name)
-                
-                edges.append({
-                    'source': state_name,
-                    'target': edge_name,
-                    'probability': float(probability),
-                    'is_optimal': is_optimal
-                })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 400
+
+@app.route('/api/solve/sweep', methods=['POST'])
+def solve_mdp_sweep():
+    """Solve the same model for several 'discount_factors' in one batched run"""
+    try:
+        data = request.json
+        discount_factors = [float(df) for df in data.get('discount_factors', [0.9])]
+        minimize = data.get('minimize', False)
+        minimize = [bool(m) for m in minimize] if isinstance(minimize, list) else [bool(minimize)]
+        _, tolerance, _, precision, _, _, _, max_iterations = solver_parameters(data)
         
-        # Prepare response
-        result = {
-            'success': True,
-            'policy': {name: str(action) for name, action in mdp.policy.items()},
-            'values': {name: float(node.value) for name, node in mdp.items()},
-            'converged': True,
-            'graph': {
-                'nodes': nodes,
-                'edges': edges
-            }
-        }
+        mdp = MDP(tol=tolerance, max_iter=max_iterations, precision=precision)
+        MDP.parse_input(mdp, lines=model_lines(data))
+        configurations = [{
+            'discount_factor': df,
+            'minimize': use_min,
+            'policy': dict(policy),
+            'values': values
+        } for df, use_min, policy, values in mdp.sweep_parameters(discount_factors, minimize)]
         
-        return jsonify(result)
+        return jsonify({'success': True, 'configurations': configurations})
         
     except Exception as e:
         return jsonify({
@@ -114,6 +483,107 @@ def solve_mdp():
             'traceback': traceback.format_exc()
         }), 400
 
+@app.route('/api/solutions/<solution_id>/graph', methods=['GET'])
+def solution_graph(solution_id):
+    """Nodes and edges of a solved model, a page of states at a time or streamed as NDJSON"""
+    view = solution_graphs.get(solution_id)
+    if view is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired solution, solve the model again'}), 404
+    try:
+        args = request.args
+        edges = args.get('edges', 'all')
+        if edges not in EDGE_FILTERS:
+            raise ValueError(f"edges must be one of {', '.join(EDGE_FILTERS)}")
+        top = args.get('top', type=int)
+        radius = args.get('radius', 1, type=int)
+        offset = args.get('offset', 0, type=int)
+        if (top is not None and top < 0) or radius < 0 or offset < 0:
+            raise ValueError('top, radius and offset must not be negative')
+        ids = view.select(top, args.get('order', 'desc') == 'asc', args.get('state'), radius)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        records = view.records(ids, edges, offset, args.get('limit', type=int))
+        lines = (json.dumps(record) + '\n' for record in records)
+        return app.response_class(lines, mimetype='application/x-ndjson')
+    
+    limit = min(max(args.get('limit', GRAPH_PAGE_SIZE, type=int), 1), GRAPH_MAX_PAGE_SIZE)
+    page = view.page(ids, edges, offset, limit)
+    following = offset + limit
+    return jsonify({
+        'success': True,
+        'total_nodes': len(ids),
+        'offset': offset,
+        'limit': limit,
+        'next': f'{request.path}?{urlencode({**args.to_dict(), "offset": following})}' if following < len(ids) else None,
+        **page
+    })
+
+@app.route('/api/solutions/<solution_id>/lookup', methods=['GET', 'POST'])
+def solution_lookup(solution_id):
+    """Action and value of some states of a solved model, read from its solution file"""
+    solution = open_solution(solution_id)
+    if solution is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired solution, solve the model again'}), 404
+    states = (request.get_json(silent=True) or {}).get('states', []) if request.method == 'POST' else \
+        request.args.getlist('state')
+    if not isinstance(states, list) or not all(isinstance(state, str) for state in states):
+        return jsonify({'success': False, 'error': 'states must be a list of state names'}), 400
+    return jsonify({'success': True, 'states': dict(zip(states, solution.lookup(states)))})
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a solve in the background, takes the same body as /api/solve"""
+    try:
+        job = job_queue.submit(request.json)
+    except Full as e:
+        return jsonify({'success': False, 'error': f'Too many queued jobs: {e}'}), 429, {'Retry-After': '1'}
+    return jsonify(job), 202, {'Location': f'/api/jobs/{job["job_id"]}'}
+
+@app.route('/api/jobs', methods=['GET'])
+def job_stats():
+    """Number of jobs in each status"""
+    return jsonify(job_queue.stats())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a job, with the /api/solve response in 'result' once it is done or the 'error' if it failed"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Solve counts, phase times and work counters in the Prometheus text format"""
+    cache = solution_cache.stats()
+    jobs = job_queue.stats()['jobs']
+    extra = {
+        'solution_cache_bytes': ('Bytes of cached /api/solve responses', 'gauge', cache['bytes']),
+        'solution_cache_entries': ('Cached /api/solve responses', 'gauge', cache['entries']),
+        'solution_cache_hits_total': ('Solution cache hits', 'counter', cache['hits']),
+        'solution_cache_misses_total': ('Solution cache misses', 'counter', cache['misses']),
+        'model_store_bytes': ('Bytes of the models of /api/models in memory', 'gauge',
+                              model_store.stats()['bytes']),
+        'jobs_queued': ('Jobs waiting for a worker', 'gauge', jobs['queued']),
+        'jobs_running': ('Jobs being solved', 'gauge', jobs['running']),
+    }
+    return app.response_class(metrics.prometheus(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/solve/cache', methods=['GET'])
+def solution_cache_stats():
+    """Hit/miss counters and size of the solution cache"""
+    return jsonify(solution_cache.stats())
+
 @app.route('/api/validate', methods=['POST'])
 def validate_mdp():
     """Validate MDP structure"""
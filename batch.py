@@ -0,0 +1,163 @@
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import Pool
+from mdp import argument_parser, read_args
+
+
+def model_files(paths):
+    """The model files named by a list of files, directories (every .txt file in them) and glob patterns,
+        in order and without repeats"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "*.txt")))
+        elif os.path.exists(path):
+            matches = [path]
+        else:
+            matches = sorted(glob.glob(path))
+        if not matches:
+            print(f"{path}: no model files", file=sys.stderr)
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def file_flags(file_name, flags):
+    """The flags of a file given a {pattern: flags} dict, patterns match the file name or the path. All the
+        matching entries are used in the order of the dict, so later ones override earlier ones"""
+    argv = []
+    for pattern, extra in flags.items():
+        if fnmatch.fnmatch(os.path.basename(file_name), pattern) or fnmatch.fnmatch(file_name, pattern):
+            argv.extend(extra.split())
+    return argv
+
+
+@contextmanager
+def time_limit(seconds):
+    """Raises TimeoutError in the block once it ran for seconds. Uses SIGALRM, so there is no limit on systems
+        without it or outside the main thread"""
+    if not seconds or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise TimeoutError(f"no result after {seconds:g}s")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def solve_file(task):
+    """Solves one model file with its mdp.py flags in at most timeout seconds (None for no limit), runs in the
+        worker processes. Returns a JSON ready record, errors and timeouts are reported in the record instead of
+        raised"""
+    file_name, argv, timeout = task
+    record = {"file": file_name, "flags": " ".join(argv), "success": False}
+    start = time.perf_counter()
+    try:
+        with time_limit(timeout):
+            args = argument_parser().parse_args(argv + [file_name])
+            if args.sweep:
+                raise ValueError("-sweep is not supported in batch runs")
+            if args.workers != 1:
+                raise ValueError("-workers is not supported in batch runs, use the -workers of batch.py")
+            if args.d:
+                raise ValueError("-d is not supported in batch runs")
+            mdp = read_args(args)
+            record["parse_seconds"] = time.perf_counter() - start
+            mdp.solve()
+            record["solve_seconds"] = time.perf_counter() - start - record["parse_seconds"]
+            record.update(success=True, policy=dict(mdp.policy),
+                          values={name: float(mdp[name].value) for name in sorted(mdp.keys())},
+                          solution=mdp.solution_text(), converged=bool(mdp.converged), gap=mdp.gap,
+                          stats=mdp.stats.to_dict())
+    except SystemExit:
+        record["error"] = f"invalid flags: {' '.join(argv)}"
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = time.perf_counter() - start
+    return record
+
+
+def solution_path(out_dir, file_name, base):
+    """Where -out writes the solution of a file: its path relative to base, the common directory of all the files"""
+    name = os.path.splitext(os.path.relpath(os.path.abspath(file_name), base))[0]
+    return os.path.join(out_dir, f"{name}.txt")
+
+
+def run(files, flags=None, default_flags="", workers=None, chunk_size=None, timeout=None):
+    """Solves every file in a pool of worker processes and yields a record per file as it is done.
+        flags is a {pattern: flags} dict applied after default_flags (see file_flags). A file that takes longer than
+        timeout seconds is stopped and its record is a failure, the worker goes on with the next file"""
+    tasks = [(file_name, default_flags.split() + file_flags(file_name, flags or {}), timeout) for file_name in files]
+    workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+    if workers == 1:
+        yield from map(solve_file, tasks)
+        return
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(solve_file, tasks, chunk_size or max(1, len(tasks) // (workers * 4)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solves many model files in parallel in a single run')
+    parser.add_argument('paths', nargs='+', help='model files, directories (every .txt file in them) or glob patterns')
+    parser.add_argument('-flags', default='', help="mdp.py flags for every file, e.g. -flags='-tol 0.001'")
+    parser.add_argument('-file_flags', metavar='JSON',
+                        help='JSON file of {"pattern": "flags"} with extra mdp.py flags for the matching files, '
+                             'e.g. {"input3.txt": "-min", "input6.txt": "-df 0.9"}')
+    parser.add_argument('-workers', type=int, help='number of worker processes, defaults to the number of CPUs')
+    parser.add_argument('-jsonl', default='-', help="file to write a JSON record per model to, defaults to '-' "
+                                                    "(standard output)")
+    parser.add_argument('-out', metavar='DIR', help='also write the solution of each model to DIR/<name>.txt, '
+                                                    'keeping the directories below the common one of the files')
+    parser.add_argument('-timeout', type=float, default=600,
+                        help='seconds before a file is stopped and reported as failed, 0 for no limit, defaults to 600')
+    args = parser.parse_args(sys.argv[1:])
+
+    flags = {}
+    if args.file_flags:
+        with open(args.file_flags) as flags_file:
+            flags = json.load(flags_file)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    files = model_files(args.paths)
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(file_name)) for file_name in files]) if files else ""
+
+    start = time.perf_counter()
+    solved = failed = 0
+    file_seconds = 0.0
+    out_file = sys.stdout if args.jsonl == '-' else open(args.jsonl, 'w')
+    try:
+        for record in run(files, flags, args.flags, args.workers, timeout=args.timeout):
+            file_seconds += record["seconds"]
+            solution = record.pop("solution", None)
+            if record["success"]:
+                solved += 1
+                if args.out:
+                    path = solution_path(args.out, record["file"], base)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'w') as solution_file:
+                        solution_file.write(solution)
+            else:
+                failed += 1
+                print(f"{record['file']}: {record['error']}", file=sys.stderr)
+            out_file.write(json.dumps(record) + "\n")
+            out_file.flush()
+    finally:
+        if out_file is not sys.stdout:
+            out_file.close()
+    wall = time.perf_counter() - start
+    print(f"Solved {solved} of {len(files)} files ({failed} failed) in {wall:.3f}s, {file_seconds:.3f}s of per file "
+          f"time, {len(files) / wall if wall else 0:,.1f} files/s", file=sys.stderr)
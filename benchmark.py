@@ -0,0 +1,189 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+from generate import GENERATORS, write_model
+
+
+def model_file(directory, model, states, seed):
+    """Path of a generated model, written the first time it is asked for"""
+    path = os.path.join(directory, f"{model}-{states}-{seed}.txt")
+    if not os.path.exists(path):
+        with open(f"{path}.tmp", "w") as out_file:
+            write_model(out_file, model, states, seed)
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def run_case(path, solver, precision, stream, tol, max_iter, k, workers, connection):
+    """Parses, solves and formats one model in a fresh process and sends back its timings and peak memory"""
+    from mdp import MDP
+    start = time.perf_counter()
+    read = MDP.read_stream if stream else MDP.read_file
+    mdp = read(path, tol=tol, max_iter=max_iter, precision=precision, solver=solver, k=k, workers=workers)
+    parsed = time.perf_counter()
+    mdp.solve()
+    solved = time.perf_counter()
+    mdp.solution_text()
+    done = time.perf_counter()
+    connection.send({"states": len(mdp), "parse_seconds": parsed - start, "solve_seconds": solved - parsed,
+                     "output_seconds": done - solved,
+                     "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                     **{name: count for name, count in mdp.stats.counters.items()}})
+    connection.close()
+
+
+def benchmark(path, solver, precision="float64", stream=False, tol=0.01, max_iter=100, timeout=None, k=20,
+              workers=1):
+    """Times one case in a new (spawned, so the peak memory is its own) process. Returns the result dict, with
+        an 'error' instead of the timings when it failed or took longer than timeout seconds.
+        k is the number of evaluation sweeps of the mpi solver, workers the processes of the sweeps. The peak memory
+        is the one of the main process, the shared arrays are counted but not the rest of the workers"""
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(path, solver, precision, stream, tol, max_iter, k, workers,
+                                                             sender))
+    process.start()
+    sender.close()
+    if receiver.poll(timeout):
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = {"error": "the benchmark process failed"}
+    else:
+        process.terminate()
+        result = {"error": f"timeout after {timeout}s"}
+    process.join()
+    return result
+
+
+def case_name(result):
+    """The solver of a result, with its k for mpi and its number of workers when there are several"""
+    name = f"{result['solver']}:{result['k']}" if result.get("k") is not None else result["solver"]
+    return f"{name}x{result['workers']}" if result.get("workers", 1) > 1 else name
+
+
+def best_k(results):
+    """The fastest mpi k of every model and size, as {(model, size): (k, solve seconds)}"""
+    best = {}
+    for result in results:
+        if result.get("k") is None or "error" in result:
+            continue
+        key = (result["model"], result["size"])
+        if key not in best or result["solve_seconds"] < best[key][1]:
+            best[key] = (result["k"], result["solve_seconds"])
+    return best
+
+
+def scaling(results):
+    """The solve time of every case by number of workers, as {(model, size, solver, k, precision): {workers:
+        seconds}} for the cases that ran with more than one number of workers"""
+    curves = {}
+    for result in results:
+        if "error" not in result:
+            key = (result["model"], result["size"], result["solver"], result.get("k"), result["precision"])
+            curves.setdefault(key, {})[result.get("workers", 1)] = result["solve_seconds"]
+    return {key: curve for key, curve in curves.items() if len(curve) > 1}
+
+
+def compare(results, baseline, threshold=0.25, noise=0.01):
+    """The cases that got slower than the baseline by more than threshold (a fraction) in parse or solve time.
+        Times under noise seconds in both runs are ignored"""
+    previous = {(r["model"], r["size"], case_name(r), r["precision"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["model"], result["size"], case_name(result), result["precision"]))
+        if old is None or "error" in result or "error" in old:
+            continue
+        for key in ("parse_seconds", "solve_seconds"):
+            if max(result[key], old[key]) >= noise and result[key] > old[key] * (1 + threshold):
+                regressions.append(f"{result['model']} {result['size']} {case_name(result)} {result['precision']}: "
+                                   f"{key} {old[key]:.3f}s -> {result[key]:.3f}s")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times parse, solve and output on generated models')
+    parser.add_argument('-models', nargs='+', default=list(GENERATORS), choices=list(GENERATORS),
+                        help='kinds of models, defaults to all')
+    parser.add_argument('-sizes', nargs='+', type=int, default=[100, 1000, 10000, 100000],
+                        help='approximate numbers of states, defaults to 100 1000 10000 100000')
+    parser.add_argument('-solvers', nargs='+', default=['vi', 'pi', 'ps', 'scc', 'mpi'], help='solvers, defaults to all')
+    parser.add_argument('-k', nargs='+', type=int, default=[0, 5, 20, 100],
+                        help='evaluation sweeps of the mpi solver, every k is a case, defaults to 0 5 20 100')
+    parser.add_argument('-workers', nargs='+', type=int, default=[1],
+                        help='processes of the parallel sweeps of vi, pi and mpi, every number is a case and the '
+                             'solve times are printed as a scaling curve, defaults to 1')
+    parser.add_argument('-precisions', nargs='+', default=['float64'], help='precisions, defaults to float64')
+    parser.add_argument('-stream', action='store_true', help='parse with the streaming parser')
+    parser.add_argument('-tol', type=float, default=0.01, help='tolerance, defaults to 0.01')
+    parser.add_argument('-iter', type=int, default=100, help='max iterations, defaults to 100')
+    parser.add_argument('-repeat', type=int, default=1, help='runs of every case, the fastest is kept')
+    parser.add_argument('-timeout', type=float, default=120, help='seconds before a case is stopped, defaults to 120')
+    parser.add_argument('-seed', type=int, default=0, help='random seed of the models, defaults to 0')
+    parser.add_argument('-dir', default=os.path.join(tempfile.gettempdir(), 'mdp-benchmark'),
+                        help='directory of the generated models, reused between runs')
+    parser.add_argument('-o', metavar='FILE', help='write the results as JSON to FILE')
+    parser.add_argument('-baseline', metavar='FILE', help='compare with the results of an earlier run and exit with '
+                                                          'status 1 when a case got slower')
+    parser.add_argument('-threshold', type=float, default=0.25,
+                        help='slowdown (as a fraction) that counts as a regression, defaults to 0.25')
+    args = parser.parse_args(sys.argv[1:])
+
+    os.makedirs(args.dir, exist_ok=True)
+    results = []
+    print(f"{'model':<8} {'size':>8} {'solver':<10} {'precision':<9} {'states':>8} {'parse s':>9} {'solve s':>9} "
+          f"{'output s':>9} {'peak MB':>8}")
+    for model in args.models:
+        for size in args.sizes:
+            path = model_file(args.dir, model, size, args.seed)
+            for precision in args.precisions:
+                for solver, k, workers in [(solver, k, workers) for solver in args.solvers
+                                           for k in (args.k if solver == 'mpi' else [None])
+                                           for workers in (args.workers if solver in ('vi', 'pi', 'mpi') else [1])]:
+                    runs = [benchmark(path, solver, precision, args.stream, args.tol, args.iter, args.timeout,
+                                      20 if k is None else k, workers)
+                            for _ in range(args.repeat)]
+                    ok = [run for run in runs if "error" not in run]
+                    result = min(ok, key=lambda run: run["parse_seconds"] + run["solve_seconds"]) if ok else runs[0]
+                    result = {"model": model, "size": size, "solver": solver, "k": k, "workers": workers,
+                              "precision": precision, **result}
+                    results.append(result)
+                    name = case_name(result)
+                    if "error" in result:
+                        print(f"{model:<8} {size:>8} {name:<10} {precision:<9} {result['error']}")
+                    else:
+                        print(f"{model:<8} {size:>8} {name:<10} {precision:<9} {result['states']:>8} "
+                              f"{result['parse_seconds']:>9.3f} {result['solve_seconds']:>9.3f} "
+                              f"{result['output_seconds']:>9.3f} {result['peak_mb']:>8.1f}")
+                    sys.stdout.flush()
+
+    for (model, size), (k, seconds) in best_k(results).items():
+        print(f"Best mpi k for {model} {size}: {k} ({seconds:.3f}s)")
+    for (model, size, solver, k, precision), curve in scaling(results).items():
+        name = solver if k is None else f"{solver}:{k}"
+        single = curve.get(1)
+        print(f"Scaling of {model} {size} {name} {precision}: " + ", ".join(
+            f"{workers} x {seconds:.3f}s" + (f" ({single / seconds:.2f}x)" if single else "")
+            for workers, seconds in sorted(curve.items())))
+
+    report = {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+              "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "stream": args.stream,
+              "tol": args.tol, "max_iter": args.iter, "results": results}
+    if args.o:
+        with open(args.o, "w") as out_file:
+            json.dump(report, out_file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions", file=sys.stderr)
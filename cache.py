@@ -0,0 +1,183 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from compiled import CompiledMDP
+
+# part of every key, bump it when the cached layout changes so old entries are never read
+CACHE_VERSION = 1
+
+
+class ModelCache:
+    """A directory of compiled models stored as .npz files named after a hash of their source text"""
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(text, dtype=np.float64):
+        """Key of a model given its source as bytes"""
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{np.dtype(dtype).name}:".encode())
+        digest.update(text)
+        return digest.hexdigest()
+
+    @staticmethod
+    def file_key(file_name, dtype=np.float64, chunk_size=1 << 20):
+        """Key of a model file, hashed in chunks so the file is never held in memory"""
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{np.dtype(dtype).name}:".encode())
+        with open(file_name, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Returns the cached CompiledMDP or None, unreadable entries are removed"""
+        path = self.path(key)
+        try:
+            compiled = CompiledMDP.load(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        # marks the entry as used, another process may have evicted it since it was loaded
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return compiled
+
+    def put(self, key, compiled):
+        # write to a temporary file first so a concurrent reader never sees a partial entry
+        temporary = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as out_file:
+            compiled.save(out_file)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries, then the least recently used ones until the cache fits in max_bytes"""
+        evict_files(self.directory, ".npz", self.max_bytes, self.max_age)
+
+
+def evict_files(directory, suffix, max_bytes=None, max_age=None):
+    """Removes the files of a directory ending in suffix older than max_age, then the oldest past max_bytes"""
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort()
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        expired = max_age is not None and now - mtime > max_age
+        if not expired and (max_bytes is None or total <= max_bytes):
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class LRUCache:
+    """Thread safe in-memory cache bounded by the total size of its values, on_evict gets the dropped entries"""
+
+    def __init__(self, max_bytes, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        """Whether the key is cached, without counting a hit or a miss or marking it as used"""
+        with self.lock:
+            return key in self.entries
+
+    def discard(self, key):
+        """Drops the entry of a key if there is one, it isn't counted as an eviction"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def put(self, key, value, size):
+        evicted = []
+        with self.lock:
+            if size > self.max_bytes:
+                evicted.append((key, value))
+            else:
+                if key in self.entries:
+                    self.size -= self.entries.pop(key)[1]
+                self.entries[key] = (value, size)
+                self.size += size
+                while self.size > self.max_bytes:
+                    evicted_key, (evicted_value, evicted_size) = self.entries.popitem(last=False)
+                    self.size -= evicted_size
+                    self.evictions += 1
+                    evicted.append((evicted_key, evicted_value))
+        # outside the lock, so on_evict can use other caches
+        if self.on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+class ModelStore:
+    """Compiled models of the model registry, the least recently used are spilled to a ModelCache or dropped"""
+
+    def __init__(self, max_bytes, spill_directory=None, spill_max_bytes=None):
+        self.spill = ModelCache(spill_directory, max_bytes=spill_max_bytes) if spill_directory else None
+        self.memory = LRUCache(max_bytes, on_evict=self.spill_model)
+
+    def spill_model(self, key, compiled):
+        if self.spill is not None and not os.path.exists(self.spill.path(key)):
+            self.spill.put(key, compiled)
+
+    def put(self, key, compiled):
+        self.memory.put(key, compiled, compiled.nbytes)
+
+    def get(self, key):
+        """Returns the CompiledMDP or None when it is unknown or was dropped"""
+        compiled = self.memory.get(key)
+        if compiled is None and self.spill is not None:
+            compiled = self.spill.get(key)
+            if compiled is not None:
+                self.memory.put(key, compiled, compiled.nbytes)
+        return compiled
+
+    def stats(self):
+        stats = self.memory.stats()
+        if self.spill is not None:
+            stats['spilled'] = sum(entry.name.endswith(".npz") for entry in os.scandir(self.spill.directory))
+        return stats
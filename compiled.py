@@ -0,0 +1,531 @@
+import heapq
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+from scipy.sparse import linalg
+
+CHANCE, DECISION, TERMINAL = 0, 1, 2
+NODE_CLASSES = ("chance", "decision", "terminal")
+# below this many states a group of backups is done state by state instead of slicing the sparse matrix
+SMALL = 32
+# prioritized sweeping backs up the queued states within this factor of the top priority together, at most BATCH
+BATCH_RATIO = 0.25
+BATCH = 4096
+# policy evaluation solves systems up to this many states with a sparse LU, larger ones with BiCGSTAB
+DIRECT_SOLVE = 2000
+
+
+def sweep(policy_matrix, rewards, values, df, tol, max_iter):
+    """Jacobi sweeps v = r + df * P v, returns the values and the number of the last sweep"""
+    df = rewards.dtype.type(df)
+    iter_num = 0
+    while True:
+        new_values = rewards + df * (policy_matrix @ values)
+        delta = np.max(np.abs(new_values - values), initial=0)
+        values = new_values
+        if delta <= tol or iter_num >= max_iter:
+            break
+        iter_num += 1
+    return values, iter_num
+
+
+def ranges(starts, counts):
+    """The concatenated ranges starts[i]:starts[i] + counts[i]"""
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+
+
+def transition_rows(node_class, success_rate, successors, probabilities, n, dtype=np.float64):
+    """The rows of a list of states, see CompiledMDP.build. Returns the row pointer of each state, the action of every
+        row and the rows as a CSR matrix with n columns"""
+    action_ptr = np.zeros(len(successors) + 1, dtype=np.int64)
+    action_target, indptr, indices, data = [], [0], [], []
+    for i, targets in enumerate(successors):
+        if node_class[i] == DECISION:
+            rate = success_rate[i]
+            other = (1 - rate) / (len(targets) - 1) if len(targets) > 1 else 0.0
+            for action in targets:
+                action_target.append(action)
+                indices.extend(targets)
+                data.extend(rate if t == action else other for t in targets)
+                indptr.append(len(indices))
+        else:
+            action_target.append(-1)
+            indices.extend(targets)
+            data.extend(probabilities[i])
+            indptr.append(len(indices))
+        action_ptr[i + 1] = len(action_target)
+    transitions = sparse.csr_matrix((np.array(data, dtype=dtype), np.array(indices, dtype=np.int64),
+                                     np.array(indptr, dtype=np.int64)), shape=(len(action_target), n))
+    return action_ptr, np.array(action_target, dtype=np.int64), transitions
+
+
+class CompiledMDP:
+    """Array form of an MDP: one row of a CSR transition matrix per (state, action) pair"""
+
+    def __init__(self, names, rewards, node_class, success_rate, action_ptr, action_target, transitions, index=None):
+        self.names = names
+        self.index = {name: i for i, name in enumerate(names)} if index is None else index
+        self.rewards = rewards
+        self.node_class = node_class
+        self.success_rate = success_rate
+        self.action_ptr = action_ptr  # the rows of state s are action_ptr[s]:action_ptr[s + 1]
+        self.action_target = action_target  # the edge chosen by each row, -1 for chance and terminal rows
+        self.transitions = transitions
+        self.row_state = np.repeat(np.arange(len(names)), np.diff(action_ptr))  # the state that owns each row
+        self.row_ids = None  # for tables made by restrict, the ids of the rows in the full table
+        self._predecessors = None
+        self._uniform = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def dtype(self):
+        return self.rewards.dtype
+
+    @property
+    def nbytes(self):
+        """Approximate memory of the table, the arrays plus about 100 bytes per state for the names and their index"""
+        arrays = (self.rewards, self.node_class, self.success_rate, self.action_ptr, self.action_target, self.row_state,
+                  self.transitions.data, self.transitions.indices, self.transitions.indptr)
+        return sum(array.nbytes for array in arrays) + 100 * len(self)
+
+    @staticmethod
+    def from_mdp(mdp, dtype=np.float64):
+        """Builds the arrays from the Node objects of a parsed MDP"""
+        names = list(mdp.keys())
+        index = {name: i for i, name in enumerate(names)}
+        if not names:
+            return CompiledMDP.build(names, [], [], [], [], [], dtype)
+        return CompiledMDP.build(names, *zip(*(CompiledMDP.node_entry(mdp[name], index) for name in names)),
+                                 dtype=dtype)
+
+    @staticmethod
+    def node_entry(node, index):
+        """(reward, node class, success rate, successor ids, probabilities) of a Node, the per state values of build"""
+        return (float(node.reward), NODE_CLASSES.index(node.node_class),
+                float(node.success_rate) if node.is_decision() else 0.0, [index[e] for e in node.edges.keys()],
+                [float(p) for p in node.edges.values()])
+
+    @staticmethod
+    def build(names, rewards, node_class, success_rate, successors, probabilities, dtype=np.float64):
+        """Builds the transition table from per state lists of successor ids and probabilities"""
+        n = len(names)
+        action_ptr, action_target, transitions = transition_rows(node_class, success_rate, successors, probabilities,
+                                                                 n, dtype)
+        return CompiledMDP(names, np.array(rewards, dtype=dtype), np.array(node_class, dtype=np.int8),
+                           np.array(success_rate, dtype=dtype), action_ptr, action_target, transitions)
+
+    def with_states(self, names, states):
+        """A copy of the table where the states of {id: (reward, node class, success rate, successors,
+            probabilities)} are replaced or added, names is the new list of names"""
+        n = len(names)
+        ids = np.array(sorted(states), dtype=np.int64)
+        reward, node_class, success_rate, successors, probabilities = (zip(*(states[s] for s in ids.tolist())) if states
+                                                                       else ((),) * 5)
+        new_ptr, new_target, new_rows = transition_rows(node_class, success_rate, successors, probabilities, n,
+                                                        self.dtype)
+        grow = n - len(self)
+        rewards = np.concatenate([self.rewards, np.zeros(grow, dtype=self.dtype)])
+        classes = np.concatenate([self.node_class, np.zeros(grow, dtype=np.int8)])
+        rates = np.concatenate([self.success_rate, np.zeros(grow, dtype=self.dtype)])
+        rewards[ids], classes[ids], rates[ids] = reward, node_class, success_rate
+        # keep the rows of the other states, append the new rows and put everything back in state order
+        keep = ~np.isin(self.row_state, ids)
+        old_rows = sparse.csr_matrix((self.transitions.data, self.transitions.indices, self.transitions.indptr),
+                                     shape=(self.transitions.shape[0], n))[keep]
+        row_state = np.concatenate([self.row_state[keep], np.repeat(ids, np.diff(new_ptr))])
+        order = np.argsort(row_state, kind="stable")
+        transitions = sparse.vstack([old_rows, new_rows], format="csr")[order]
+        action_target = np.concatenate([self.action_target[keep], new_target])[order]
+        counts = np.concatenate([np.diff(self.action_ptr), np.zeros(grow, dtype=np.int64)])
+        counts[ids] = np.diff(new_ptr)
+        action_ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return CompiledMDP(names, rewards, classes, rates, action_ptr, action_target, transitions)
+
+    def save(self, file):
+        """Writes the arrays to an uncompressed .npz file (a path or a binary file object)"""
+        np.savez(file, names=np.array(self.names, dtype=str), rewards=self.rewards, node_class=self.node_class,
+                 success_rate=self.success_rate, action_ptr=self.action_ptr, action_target=self.action_target,
+                 indptr=self.transitions.indptr, indices=self.transitions.indices, data=self.transitions.data)
+
+    @staticmethod
+    def load(file):
+        """Reads a CompiledMDP written by save"""
+        with np.load(file) as arrays:
+            n = len(arrays["names"])
+            transitions = sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                            shape=(len(arrays["action_target"]), n))
+            return CompiledMDP(arrays["names"].tolist(), arrays["rewards"], arrays["node_class"],
+                               arrays["success_rate"], arrays["action_ptr"], arrays["action_target"], transitions)
+
+    def policy_rows(self, policy):
+        """Translates a {decision node: action} mapping into one transition row per state"""
+        rows = self.action_ptr[:-1].copy()
+        if not policy:
+            return rows
+        states = np.fromiter((self.index[name] for name in policy.keys()), dtype=np.int64, count=len(policy))
+        actions = np.fromiter((self.index[action] for action in policy.values()), dtype=np.int64, count=len(policy))
+        # look the (state, action) pairs up among the sorted keys of all rows
+        keys = self.row_state * (len(self) + 1) + self.action_target + 1
+        order = np.argsort(keys)
+        wanted = states * (len(self) + 1) + actions + 1
+        found = order[np.minimum(np.searchsorted(keys, wanted, sorter=order), len(keys) - 1)]
+        if np.any(keys[found] != wanted):
+            raise ValueError("The policy chooses an action that is not an edge of its node")
+        rows[states] = found
+        return rows
+
+    def policy_from_rows(self, rows):
+        """Inverse of policy_rows, returns a {decision node: action} dict"""
+        decisions = np.flatnonzero(self.node_class == DECISION)
+        return {self.names[s]: self.names[self.action_target[rows[s]]] for s in decisions}
+
+    def value_iteration(self, rows, values, df, tol, max_iter):
+        """Synchronous sweeps v = r + df * P_pi v until no value moves by more than tol or max_iter is reached.
+            Returns the new values and the number of the last sweep."""
+        return sweep(self.transitions[rows], self.rewards, values, df, tol, max_iter)
+
+    def q_values(self, values, df):
+        """Value of every (state, action) row given the values of the successors"""
+        return self.rewards[self.row_state] + self.dtype.type(df) * (self.transitions @ values)
+
+    def bellman(self, values, df, use_min=False):
+        """One Bellman optimality backup of every state, returns the best Q value of each state"""
+        if not len(self):
+            return values.copy()
+        return (np.minimum if use_min else np.maximum).reduceat(self.q_values(values, df), self.action_ptr[:-1])
+
+    def greedy_rows(self, values, df, use_min=False, current=None):
+        """Greedy policy improvement for all states at once, a state keeps its current row while it is still best"""
+        return self.greedy(values, df, use_min, current)[0]
+
+    def greedy(self, values, df, use_min=False, current=None):
+        """greedy_rows and the best Q value of every state, which is the Bellman backup of the values"""
+        if not len(self):
+            return self.action_ptr[:-1].copy(), values.copy()
+        q = self.q_values(values, df)
+        starts = self.action_ptr[:-1]
+        best = (np.minimum if use_min else np.maximum).reduceat(q, starts)
+        is_best = q == best[self.row_state]
+        rows = np.minimum.reduceat(np.where(is_best, np.arange(len(q)), len(q)), starts)
+        if current is not None:
+            rows = np.where(is_best[current], current, rows)
+        return rows, best
+
+    @staticmethod
+    def value_bounds(values, backed_up, df):
+        """MacQueen bounds on the optimal values from any values and their Bellman backup, for df < 1"""
+        delta = backed_up - values
+        scale = df / (1 - df)
+        # the shifts are clamped at 0, which keeps the bounds valid when rows lose probability (terminal nodes)
+        return backed_up + scale * np.min(delta, initial=0), backed_up + scale * np.max(delta, initial=0)
+
+    def optimal_rows(self, lower, upper, df, use_min=False):
+        """Mask of the rows that can still be optimal given bounds on the optimal values"""
+        # MacQueen's test, a few ulps of slack keep rounding errors from dropping a best row
+        if use_min:
+            q, bound = self.q_values(lower, df), upper[self.row_state]
+            return q <= bound + 16 * np.finfo(self.dtype).eps * (1 + np.abs(bound))
+        q, bound = self.q_values(upper, df), lower[self.row_state]
+        return q >= bound - 16 * np.finfo(self.dtype).eps * (1 + np.abs(bound))
+
+    def restrict(self, keep):
+        """The table with only the rows in the keep mask, row_ids maps them back to the full table"""
+        rows = np.flatnonzero(keep)
+        counts = np.bincount(self.row_state[rows], minlength=len(self))
+        action_ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        table = CompiledMDP(self.names, self.rewards, self.node_class, self.success_rate, action_ptr,
+                            self.action_target[rows], self.transitions[rows], self.index)
+        table.row_ids = rows if self.row_ids is None else self.row_ids[rows]
+        return table
+
+    def uniform_decisions(self):
+        """Mask of the decision states whose rows all move to the same successors, which are backed up in O(k)"""
+        if self._uniform is None:
+            counts = np.diff(self.action_ptr)
+            row_nnz = np.diff(self.transitions.indptr)
+            same = np.ones(len(self), dtype=bool)
+            if len(row_nnz):
+                # every row of the state has one entry per row and a target
+                fits = (row_nnz == counts[self.row_state]) & (self.action_target >= 0)
+                same = np.logical_and.reduceat(fits, self.action_ptr[:-1]) if len(self) else same
+            self._uniform = (self.node_class == DECISION) & (counts > 0) & same
+        return self._uniform
+
+    def backup(self, s, values, df, use_min=False):
+        """Bellman backup of a single state, straight from the CSR arrays. Cheaper than slicing the matrix for one state"""
+        lo, hi = self.action_ptr[s], self.action_ptr[s + 1]
+        if self.uniform_decisions()[s]:
+            successors = values[self.action_target[lo:hi]]
+            rate = self.success_rate[s]
+            other = (1 - rate) / (hi - lo - 1) if hi - lo > 1 else 0
+            q = rate * successors + other * (successors.sum() - successors)
+            return self.rewards[s] + df * (q.min() if use_min else q.max())
+        indptr, indices, data = self.transitions.indptr, self.transitions.indices, self.transitions.data
+        pick = min if use_min else max
+        return self.rewards[s] + df * pick(data[indptr[r]:indptr[r + 1]] @ values[indices[indptr[r]:indptr[r + 1]]]
+                                           for r in range(lo, hi))
+
+    def backup_states(self, states, values, df, use_min=False):
+        """Bellman backups of a group of states from the same values (a Jacobi step)"""
+        rows, starts = self.state_rows(states)
+        counts = np.diff(starts)
+        q = np.zeros(len(rows), dtype=np.float64)
+        uniform = np.repeat(self.uniform_decisions()[states], counts)
+        if uniform.any():
+            # S of every uniform state repeated over its rows, then the Q values of the rows at once
+            successors = values[self.action_target[rows[uniform]]].astype(np.float64)
+            state_of_row = np.repeat(np.arange(len(states)), counts)[uniform]
+            totals = np.bincount(state_of_row, weights=successors, minlength=len(states))[state_of_row]
+            k = counts[state_of_row]
+            rate = self.success_rate[states][state_of_row].astype(np.float64)
+            other = np.where(k > 1, (1 - rate) / np.maximum(k - 1, 1), 0)
+            q[uniform] = rate * successors + other * (totals - successors)
+        if not uniform.all():
+            general = rows[~uniform]
+            indptr = self.transitions.indptr
+            entry_counts = indptr[general + 1] - indptr[general]
+            entries = ranges(indptr[general], entry_counts)
+            products = self.transitions.data[entries] * values[self.transitions.indices[entries]]
+            q[~uniform] = np.bincount(np.repeat(np.arange(len(general)), entry_counts), weights=products,
+                                      minlength=len(general))
+        best = (np.minimum if use_min else np.maximum).reduceat(q, starts[:-1])
+        return (self.rewards[states] + df * best).astype(self.dtype)
+
+    def batch_solve(self, rows, values, dfs, use_min, tol, max_iter):
+        """The solve loop of MDP.solve for many configurations at once, column k of rows and values is configuration k.
+            Returns the rows and values and the number of improvement rounds"""
+        rows, values = rows.copy(), values.astype(self.dtype, copy=True)
+        dfs = np.asarray(dfs, dtype=self.dtype)
+        sign = np.where(use_min, -1, 1).astype(self.dtype)
+        starts = self.action_ptr[:-1]
+        stable = np.zeros(values.shape[1], dtype=bool)
+        rounds = 0
+        while not stable.all() and len(self):
+            # policy evaluation sweeps, v = r + df * P_pi v for every configuration that didn't converge yet
+            active = ~stable
+            iter_num = 0
+            while active.any():
+                q = self.transitions @ values[:, active]
+                new_values = self.rewards[:, None] + dfs[active] * np.take_along_axis(q, rows[:, active], axis=0)
+                delta = np.max(np.abs(new_values - values[:, active]), axis=0)
+                values[:, active] = new_values
+                if iter_num >= max_iter:
+                    break
+                active[active] = delta > tol
+                iter_num += 1
+            # greedy improvement, the first best row of each state as in greedy_rows
+            improving = np.flatnonzero(~stable)
+            q = (self.transitions @ values[:, improving]) * (dfs * sign)[improving]
+            is_best = q == np.maximum.reduceat(q, starts, axis=0)[self.row_state]
+            new_rows = np.minimum.reduceat(np.where(is_best, np.arange(len(q))[:, None], len(q)), starts, axis=0)
+            stable[improving] = np.all(new_rows == rows[:, improving], axis=0)
+            rows[:, improving] = new_rows
+            rounds += 1
+        return rows, values, rounds
+
+    def predecessors(self):
+        """Reverse edges as a CSR matrix, weighted by the largest probability of each move"""
+        if self._predecessors is None:
+            n = len(self)
+            coo = self.transitions.tocoo()
+            keep = coo.data != 0
+            keys = coo.col[keep].astype(np.int64) * n + self.row_state[coo.row[keep]]
+            order = np.argsort(keys, kind="stable")
+            keys, weights = keys[order], coo.data[keep][order]
+            keys, starts = np.unique(keys, return_index=True)
+            weights = np.maximum.reduceat(weights, starts) if len(keys) else weights
+            self._predecessors = sparse.csr_matrix((weights, (keys // n, keys % n)), shape=(n, n))
+        return self._predecessors
+
+    def prioritized_sweeping(self, values, df, tol, max_iter, use_min=False, seeds=None):
+        """Asynchronous value iteration, largest Bellman residual first. Returns the values and the number of backups.
+            seeds: ids of the only states queued in the first round, for warm starts after an edit"""
+        values = values.astype(self.dtype, copy=True)
+        df = float(df)
+        predecessors = self.predecessors()
+        pred_ptr, pred_idx, pred_weight = predecessors.indptr, predecessors.indices, predecessors.data
+        budget = max_iter * len(self)
+        backups = 0
+        evaluated = None
+        while backups < budget:
+            priority = np.abs(self.bellman(values, df, use_min) - values).astype(np.float64)
+            if seeds is not None:
+                seeded = np.zeros(len(self), dtype=bool)
+                seeded[seeds] = True
+                priority[~seeded] = 0
+                seeds = None
+            # the heap holds python floats, comparing numpy scalars makes every push and pop several times slower
+            queued = np.flatnonzero(priority > tol)
+            queue = list(zip((-priority[queued]).tolist(), queued.tolist()))
+            if not queue:
+                if df < 1:
+                    break
+                rows, _ = self.greedy(values, df, use_min)
+                if evaluated is not None and np.array_equal(rows, evaluated):
+                    break
+                evaluated = rows
+                exact = self.evaluate_policy(rows, values, df, tol, max_iter)
+                if not np.isfinite(exact.astype(np.float64)).all():
+                    break
+                values = exact
+                continue
+            heapq.heapify(queue)
+            while queue and backups < budget:
+                batch, floor = [], -queue[0][0] * BATCH_RATIO
+                while queue and len(batch) < min(BATCH, budget - backups) and -queue[0][0] >= floor:
+                    key, s = heapq.heappop(queue)
+                    if -key == priority[s]:  # otherwise the state was pushed again with a higher priority
+                        priority[s] = 0
+                        batch.append(s)
+                if not batch:
+                    continue
+                states = np.array(batch, dtype=np.int64)
+                new_values = self.backup_states(states, values, df, use_min)
+                delta = np.abs(new_values - values[states]).astype(np.float64)
+                values[states] = new_values
+                backups += len(batch)
+                counts = pred_ptr[states + 1] - pred_ptr[states]
+                entries = ranges(pred_ptr[states], counts)
+                raised = pred_idx[entries]
+                np.add.at(priority, raised, df * pred_weight[entries] * np.repeat(delta, counts))
+                raised = np.unique(raised)
+                raised = raised[priority[raised] > tol]
+                for key, p in zip((-priority[raised]).tolist(), raised.tolist()):
+                    heapq.heappush(queue, (key, p))
+        return values, backups
+
+    def state_rows(self, states):
+        """The rows of a list of states and, for each state, where its rows start in that list"""
+        counts = np.diff(self.action_ptr)[states]
+        starts = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return ranges(self.action_ptr[states], counts), starts
+
+    def successor_graph(self):
+        """State to state adjacency matrix over all actions"""
+        coo = self.transitions.tocoo()
+        keep = coo.data != 0
+        return sparse.csr_matrix((np.ones(keep.sum(), dtype=np.int8), (self.row_state[coo.row[keep]], coo.col[keep])),
+                                 shape=(len(self), len(self)))
+
+    def component_levels(self):
+        """Strongly connected components of the successor graph and their level in the condensation.
+            Returns (component labels, level of each component, cyclic components)"""
+        graph = self.successor_graph()
+        n_components, labels = csgraph.connected_components(graph, directed=True, connection="strong")
+        coo = graph.tocoo()
+        src, dst = labels[coo.row], labels[coo.col]
+        cyclic = np.bincount(labels, minlength=n_components) > 1
+        cyclic[src[src == dst]] = True
+        # edges of the condensation, reversed, and a topological pass from the sinks
+        between = src != dst
+        condensation = sparse.csr_matrix((np.ones(between.sum(), dtype=np.int8), (dst[between], src[between])),
+                                         shape=(n_components, n_components))
+        condensation.sum_duplicates()
+        pred_ptr, pred_idx = condensation.indptr, condensation.indices
+        out_degree = np.bincount(pred_idx, minlength=n_components).tolist()
+        level = [0] * n_components
+        ready = [c for c in range(n_components) if out_degree[c] == 0]
+        while ready:
+            c = ready.pop()
+            for p in pred_idx[pred_ptr[c]:pred_ptr[c + 1]].tolist():
+                level[p] = max(level[p], level[c] + 1)
+                out_degree[p] -= 1
+                if out_degree[p] == 0:
+                    ready.append(p)
+        return labels, np.array(level, dtype=np.int64), cyclic
+
+    def scc_solve(self, values, df, tol, max_iter, use_min=False):
+        """Solves one strongly connected component at a time in reverse topological order.
+            Returns the values and a dict of statistics"""
+        values = values.astype(self.dtype, copy=True)
+        df = self.dtype.type(df)
+        reduce = np.minimum if use_min else np.maximum
+        labels, level, cyclic = self.component_levels()
+        state_level = level[labels]
+        by_level = np.argsort(state_level, kind="stable")
+        level_starts = np.searchsorted(state_level[by_level], np.arange(level.max(initial=-1) + 2))
+        stats = {"components": len(level), "cyclic_components": int(cyclic.sum()), "levels": len(level_starts) - 1,
+                 "sweeps": 0, "backups": 0, "unconverged_components": 0}
+        for k in range(len(level_starts) - 1):
+            states = by_level[level_starts[k]:level_starts[k + 1]]
+            in_cycle = cyclic[labels[states]]
+            single = states[~in_cycle]
+            stats["backups"] += len(single)
+            if len(single) > SMALL:
+                rows, starts = self.state_rows(single)
+                values[single] = self.rewards[single] + df * reduce.reduceat(self.transitions[rows] @ values, starts[:-1])
+            else:
+                # long chains give many tiny levels, where slicing the matrix costs more than the backups
+                for s in single.tolist():
+                    values[s] = self.backup(s, values, df, use_min)
+            cycle_states = states[in_cycle]
+            for component in (np.unique(labels[cycle_states]) if len(cycle_states) else ()):
+                members = cycle_states[labels[cycle_states] == component]
+                if len(members) > SMALL:
+                    rows, starts = self.state_rows(members)
+                    matrix, rewards = self.transitions[rows], self.rewards[members]
+                iter_num = 0
+                while True:
+                    if len(members) > SMALL:
+                        new_values = rewards + df * reduce.reduceat(matrix @ values, starts[:-1])
+                    else:
+                        new_values = np.array([self.backup(s, values, df, use_min) for s in members.tolist()],
+                                              dtype=self.dtype)
+                    delta = np.max(np.abs(new_values - values[members]))
+                    values[members] = new_values
+                    stats["sweeps"] += 1
+                    stats["backups"] += len(members)
+                    if delta <= tol:
+                        break
+                    if iter_num >= max_iter:
+                        stats["unconverged_components"] += 1
+                        break
+                    iter_num += 1
+        return values, stats
+
+    def can_exit(self, policy_matrix):
+        """Marks the states from which the process can reach a terminal node (or any row that loses probability)"""
+        n = len(self)
+        exits = np.flatnonzero(np.asarray(policy_matrix.sum(axis=1)).ravel() < 1 - 1e-6)
+        coo = policy_matrix.tocoo()
+        nonzero = coo.data != 0
+        # reverse edges plus a virtual sink (id n) pointing at every exit, a search from the sink finds them all
+        graph = sparse.csr_matrix((np.ones(nonzero.sum() + len(exits), dtype=np.int8),
+                                   (np.concatenate([coo.col[nonzero], np.full(len(exits), n)]),
+                                    np.concatenate([coo.row[nonzero], exits]))), shape=(n + 1, n + 1))
+        reached = csgraph.breadth_first_order(graph, n, directed=True, return_predecessors=False)
+        mask = np.zeros(n + 1, dtype=bool)
+        mask[reached] = True
+        return mask[:n]
+
+    def evaluate_policy(self, rows, values, df, tol, max_iter):
+        """Exact policy evaluation, solves (I - df * P_pi) v = r"""
+        policy_matrix = self.transitions[rows]
+        values = values.astype(self.dtype, copy=True)
+        solvable = np.ones(len(self), dtype=bool) if df < 1 else self.can_exit(policy_matrix)
+        closed = np.flatnonzero(~solvable)
+        solvable = np.flatnonzero(solvable)
+        rhs = self.rewards[solvable].astype(np.float64)
+        if len(closed):
+            # nothing leaves a closed set of states, so it can be swept on its own
+            values[closed], _ = sweep(policy_matrix[closed][:, closed], self.rewards[closed], values[closed], df, tol,
+                                      max_iter)
+            rhs += df * (policy_matrix[solvable][:, closed] @ values[closed])
+        if len(solvable):
+            system = sparse.identity(len(solvable), format="csc") - df * policy_matrix[solvable][:, solvable].tocsc()
+            values[solvable] = self.solve_system(system.astype(np.float64), rhs, values[solvable], df, tol)
+        return values
+
+    @staticmethod
+    def solve_system(system, rhs, guess, df, tol):
+        """Solves system x = rhs for evaluate_policy, see there"""
+        if system.shape[0] <= DIRECT_SOLVE:
+            return linalg.spsolve(system, rhs)
+        # the max norm of the error is at most the residual over 1 - df
+        atol = tol * (1 - df) * 1e-3 if df < 1 else tol * 1e-6
+        solution, info = linalg.bicgstab(system.tocsr(), rhs, x0=guess.astype(np.float64), rtol=0, atol=atol,
+                                         maxiter=max(1000, system.shape[0] // 10))
+        return solution if info == 0 and np.isfinite(solution).all() else linalg.spsolve(system, rhs)
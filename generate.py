@@ -0,0 +1,120 @@
+import argparse
+import random
+import sys
+
+# every generator takes the approximate number of states, a random.Random and the success rate of the decision nodes
+# and yields the lines of a model in the input format, so models of millions of states are never held in memory
+
+
+def probabilities(rng, k):
+    """k random probabilities in thousandths that add up to exactly 1, also in decimal precision"""
+    cuts = sorted(rng.sample(range(1, 1000), k - 1)) if k > 1 else []
+    parts = [b - a for a, b in zip([0] + cuts, cuts + [1000])]
+    return " ".join(f"{p / 1000:.3f}" for p in parts)
+
+
+def gridworld(n, rng, success=0.8):
+    """A square grid of decision nodes moving to their 2-4 neighbours, a step cost of -1, a goal (+100) in one
+        corner and a few pits (-100), which are terminal"""
+    side = max(int(round(n ** 0.5)), 2)
+    yield f"# gridworld {side}x{side}"
+    pits = set(rng.sample(range(1, side * side - 1), min(side // 2, side * side - 2)))
+    for i in range(side):
+        for j in range(side):
+            name, cell = f"x{i}y{j}", i * side + j
+            if cell == side * side - 1:
+                yield f"{name} = 100"
+                continue
+            if cell in pits:
+                yield f"{name} = -100"
+                continue
+            yield f"{name} = -1"
+            neighbours = [f"x{a}y{b}" for a, b in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1))
+                          if 0 <= a < side and 0 <= b < side]
+            yield f"{name} : [{', '.join(neighbours)}]"
+            yield f"{name} % {success}"
+
+
+def grid_block(n, rng, success=0.8):
+    """The gridworld model as a single '@grid' block (see grids.py), which is parsed without a line per state: the
+        pits and the goal are placed with 'at' lines"""
+    side = max(int(round(n ** 0.5)), 2)
+    yield f"# gridworld {side}x{side} as a grid block"
+    pits = rng.sample(range(1, side * side - 1), min(side // 2, side * side - 2))
+    yield f"@grid rows={side} cols={side} success={success} reward=-1"
+    yield "G = 100 terminal"
+    yield "P = -100 terminal"
+    yield f"G at {side - 1} {side - 1}"
+    for cell in sorted(pits):
+        yield f"P at {cell // side} {cell % side}"
+    yield "@end"
+
+
+def random_graph(n, rng, success=0.8, degree=3, decision_share=0.5, terminal_share=0.05):
+    """States with `degree` random successors, a share of decision nodes, chance nodes with random
+        probabilities and a few terminal nodes"""
+    n = max(n, degree + 1)
+    yield f"# random sparse graph of {n} states"
+    for s in range(n):
+        yield f"s{s} = {rng.randint(-10, 10)}"
+        if rng.random() < terminal_share:
+            continue
+        successors = rng.sample(range(n), degree)
+        yield f"s{s} : [{', '.join(f's{t}' for t in successors)}]"
+        if rng.random() < decision_share:
+            yield f"s{s} % {success}"
+        else:
+            yield f"s{s} % {probabilities(rng, degree)}"
+
+
+def chain(n, rng, success=0.8):
+    """A line of decision nodes that can step forward or back, ending in a terminal goal"""
+    n = max(n, 3)
+    yield f"# chain of {n} states"
+    for s in range(n - 1):
+        yield f"c{s} = {rng.randint(-2, 0)}"
+        yield f"c{s} : [c{s + 1}, c{s - 1 if s else 2}]"
+        yield f"c{s} % {success}"
+    yield f"c{n - 1} = 100"
+
+
+def hubs(n, rng, success=0.8, fanout=1000):
+    """A few decision hubs with `fanout` edges each to chance nodes that lead back to random hubs or to a terminal
+        exit, dense choices that stress policy improvement"""
+    count = max(n // (fanout + 1), 1)
+    fanout = max(min(fanout, n // count - 1), 2)
+    yield f"# {count} decision hubs with {fanout} edges each"
+    yield "exit = 0"
+    for h in range(count):
+        leaves = [f"h{h}l{k}" for k in range(fanout)]
+        yield f"h{h} = -1"
+        yield f"h{h} : [{', '.join(leaves)}]"
+        yield f"h{h} % {success}"
+        for leaf in leaves:
+            yield f"{leaf} = {rng.randint(-5, 10)}"
+            yield f"{leaf} : [h{rng.randrange(count)}, exit]"
+            yield f"{leaf} % {probabilities(rng, 2)}"
+
+
+GENERATORS = {"grid": gridworld, "gridblock": grid_block, "random": random_graph, "chain": chain, "hub": hubs}
+
+
+def write_model(out_file, model, n, seed=0, success=0.8):
+    rng = random.Random(seed)
+    for line in GENERATORS[model](n, rng, success):
+        out_file.write(line + "\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes synthetic models in the input format')
+    parser.add_argument('model', choices=list(GENERATORS), help='kind of model')
+    parser.add_argument('states', type=int, help='approximate number of states')
+    parser.add_argument('-seed', type=int, default=0, help='random seed, defaults to 0')
+    parser.add_argument('-success', type=float, default=0.8, help='success rate of the decision nodes, defaults to 0.8')
+    parser.add_argument('-o', metavar='FILE', help='output file, defaults to standard output')
+    args = parser.parse_args(sys.argv[1:])
+    if args.o:
+        with open(args.o, 'w') as model_file:
+            write_model(model_file, args.model, args.states, args.seed, args.success)
+    else:
+        write_model(sys.stdout, args.model, args.states, args.seed, args.success)
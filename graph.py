@@ -0,0 +1,95 @@
+import numpy as np
+from compiled import DECISION
+
+EDGE_FILTERS = ("all", "policy", "none")
+
+
+class SolutionGraph:
+    """The graph of a solved MDP for the web API: its compiled arrays, values and policy rows. States are selected on
+        the arrays and only the states and edges that are sent are turned into dicts, so large models can be served a
+        page (or a stream) at a time. It keeps no Nodes, so it is much smaller than the MDP"""
+
+    def __init__(self, mdp):
+        self.compiled = mdp.compiled or mdp.compile()
+        self.values = mdp.node_values()
+        self.rows = self.compiled.policy_rows(mdp.policy)
+
+    def __len__(self):
+        return len(self.compiled)
+
+    @property
+    def nbytes(self):
+        """Approximate memory of the graph, see CompiledMDP.nbytes"""
+        return self.compiled.nbytes + self.values.nbytes + self.rows.nbytes
+
+    def select(self, top=None, ascending=False, state=None, radius=1):
+        """Ids of the states to show, in compiled order: all of them, or only those within radius edges (in either
+            direction) of the named state. With top, only the top states by value among those, best first (lowest
+            first with ascending)"""
+        compiled = self.compiled
+        ids = np.arange(len(compiled))
+        if state is not None:
+            if state not in compiled.index:
+                raise ValueError(f"Unknown state '{state}'")
+            adjacency = compiled.successor_graph().astype(np.float32)
+            adjacency = (adjacency + adjacency.T).tocsr()
+            selected = np.zeros(len(compiled), dtype=bool)
+            selected[compiled.index[state]] = True
+            for _ in range(radius):
+                reached = selected | (adjacency @ selected.astype(np.float32) > 0)
+                if np.array_equal(reached, selected):
+                    break
+                selected = reached
+            ids = np.flatnonzero(selected)
+        if top is not None:
+            key = self.values[ids] if ascending else -self.values[ids]
+            best = np.argpartition(key, top)[:top] if top < len(ids) else np.arange(len(ids))
+            ids = ids[best[np.argsort(key[best], kind="stable")]]
+        return ids
+
+    def nodes(self, ids):
+        """One dict per state id, as in the 'graph' of the /api/solve response"""
+        names = self.compiled.names
+        for s, value, reward in zip(ids.tolist(), self.values[ids].tolist(), self.compiled.rewards[ids].tolist()):
+            yield {'id': names[s], 'name': names[s], 'value': value, 'reward': reward, 'type': 'state'}
+
+    def edges(self, ids, selected=None, policy_only=False):
+        """The edges leaving the given states with their probability under the policy. Only the edges into states of
+            the selected mask when given, and with policy_only only the chosen edge of each decision node"""
+        compiled = self.compiled
+        rows = self.rows[ids]
+        matrix = compiled.transitions[rows]
+        indptr, indices, data = matrix.indptr.tolist(), matrix.indices.tolist(), matrix.data.tolist()
+        chosen = compiled.action_target[rows].tolist()
+        decision = (compiled.node_class[ids] == DECISION).tolist()
+        names = compiled.names
+        for i, s in enumerate(ids.tolist()):
+            for k in range(indptr[i], indptr[i + 1]):
+                t = indices[k]
+                is_optimal = decision[i] and t == chosen[i]
+                if (policy_only and decision[i] and not is_optimal) or (selected is not None and not selected[t]):
+                    continue
+                yield {'source': names[s], 'target': names[t], 'probability': data[k], 'is_optimal': is_optimal}
+
+    def page(self, ids, edges="all", offset=0, limit=None):
+        """The nodes of ids[offset:offset + limit] and the edges leaving them into any of ids"""
+        selected = None
+        if len(ids) < len(self):
+            selected = np.zeros(len(self), dtype=bool)
+            selected[ids] = True
+        page = ids[offset:None if limit is None else offset + limit]
+        return {
+            'nodes': list(self.nodes(page)),
+            'edges': [] if edges == "none" else list(self.edges(page, selected, edges == "policy"))
+        }
+
+    def records(self, ids, edges="all", offset=0, limit=None, chunk_size=1000):
+        """The nodes and edges of page as a stream of records, a chunk of states at a time. The 'record' of each is
+            'node' or 'edge'"""
+        end = len(ids) if limit is None else min(len(ids), offset + limit)
+        for start in range(offset, end, chunk_size):
+            page = self.page(ids, edges, start, min(chunk_size, end - start))
+            for node in page['nodes']:
+                yield {'record': 'node', **node}
+            for edge in page['edges']:
+                yield {'record': 'edge', **edge}
@@ -0,0 +1,113 @@
+import numpy as np
+from scipy import sparse
+from compiled import CompiledMDP, DECISION, TERMINAL
+
+# the moves of a grid cell in edge order: up, down, left, right, as in generate.gridworld
+MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1))
+WALL = "#"
+FREE = "."
+
+
+def parse_grid(header, lines, dtype=np.float64):
+    """Compiles a grid block straight into a CompiledMDP, without a line or a Node per state.
+        header is the '@grid' line, 'rows=R cols=C' and optionally 'prefix=P' (the cells are named P + 'x{row}y{col}'),
+        'success=S' (the success rate of the moves, 1 by default) and 'reward=R' (of the free cells, 0 by default).
+        lines are the lines of the block up to '@end':
+            'K = reward' or 'K = reward terminal': the reward of the cells marked with the character K
+            'K = wall': cells marked with K are walls, '#' always is
+            '|....#..G': a row of the map, one character per cell, the rows in order. Rows can be left out at the end
+            'K at row col': marks one cell with K, for large grids without a map
+        Every cell that isn't a wall or terminal is a decision node moving to its neighbours that aren't walls, in the
+        order up, down, left, right. Cells without such a neighbour are terminal"""
+    options = dict(token.split("=", 1) for token in header.split()[1:] if "=" in token)
+    unknown = set(options) - {"rows", "cols", "prefix", "success", "reward"}
+    if unknown or "rows" not in options or "cols" not in options:
+        raise ValueError(f"Grid blocks need rows=R and cols=C, and only take prefix, success and reward: {header}")
+    height, width = int(options["rows"]), int(options["cols"])
+    prefix, success = options.get("prefix", ""), float(options.get("success", 1))
+    if height < 1 or width < 1 or not 0 <= success <= 1:
+        raise ValueError(f"Grid blocks need positive sizes and a success rate in [0, 1]: {header}")
+    legend = {FREE: (float(options.get("reward", 0)), False), WALL: None}
+    marks = np.full((height, width), ord(FREE), dtype=np.uint8)
+    map_row = 0
+    for line in lines:
+        line = line.rstrip("\r\n")
+        stripped = line.strip()
+        if not stripped or stripped[0] == "#" and "=" not in stripped:
+            continue
+        if stripped[0] == "|":
+            row = line[line.index("|") + 1:].rstrip()
+            if map_row >= height or len(row) > width:
+                raise ValueError(f"Grid map row {map_row} doesn't fit in {height}x{width}: {stripped[:40]}")
+            marks[map_row, :len(row)] = np.frombuffer(row.encode("ascii"), dtype=np.uint8)
+            map_row += 1
+        elif "=" in stripped:
+            key, _, value = stripped.partition("=")
+            key, tokens = key.strip(), value.split()
+            if len(key) != 1 or not tokens or tokens[1:] not in ([], ["terminal"]):
+                raise ValueError(f"Grid legend lines are 'K = reward', 'K = reward terminal' or 'K = wall': {stripped}")
+            legend[key] = None if tokens[0] == "wall" else (float(tokens[0]), tokens[1:] == ["terminal"])
+        elif " at " in stripped:
+            key, _, position = stripped.partition(" at ")
+            row, col = (int(x) for x in position.split())
+            if not (0 <= row < height and 0 <= col < width) or len(key.strip()) != 1:
+                raise ValueError(f"Grid cell out of range: {stripped}")
+            marks[row, col] = ord(key.strip())
+        else:
+            raise ValueError(f"Unknown line in grid block: {stripped}")
+
+    rewards = np.zeros((height, width))
+    terminal = np.zeros((height, width), dtype=bool)
+    wall = np.zeros((height, width), dtype=bool)
+    for code in np.unique(marks).tolist():
+        key = chr(code)
+        if key not in legend:
+            raise ValueError(f"Grid cell character '{key}' isn't in the legend")
+        cells = marks == code
+        if legend[key] is None:
+            wall |= cells
+        else:
+            rewards[cells], terminal[cells] = legend[key]
+
+    # state ids of the cells that aren't walls, in row major order
+    ids = np.full((height, width), -1, dtype=np.int64)
+    open_cells = ~wall
+    ids[open_cells] = np.arange(np.count_nonzero(open_cells))
+    padded = np.pad(ids, 1, constant_values=-1)
+    targets = np.stack([padded[1 + dr:1 + dr + height, 1 + dc:1 + dc + width] for dr, dc in MOVES], axis=-1)
+    targets = targets[open_cells]
+    # the neighbours of each state first, in move order
+    targets = np.take_along_axis(targets, np.argsort(targets < 0, axis=1, kind="stable"), axis=1)
+    counts = np.count_nonzero(targets >= 0, axis=1)
+    counts[terminal[open_cells]] = 0
+    decision = counts > 0
+
+    # a decision node with k neighbours has k rows of k entries, every other state a single empty row
+    row_counts = np.where(decision, counts, 1)
+    action_ptr = np.concatenate([[0], np.cumsum(row_counts)]).astype(np.int64)
+    entry_ptr = np.concatenate([[0], np.cumsum(counts * counts)]).astype(np.int64)
+    n_rows = int(action_ptr[-1])
+    action_target = np.full(n_rows, -1, dtype=np.int64)
+    row_nnz = np.zeros(n_rows, dtype=np.int64)
+    indices = np.empty(int(entry_ptr[-1]), dtype=np.int64)
+    data = np.empty(int(entry_ptr[-1]), dtype=dtype)
+    for k in range(1, len(MOVES) + 1):
+        states = np.flatnonzero(counts == k)
+        if not len(states):
+            continue
+        neighbours = targets[states, :k]
+        other = (1 - success) / (k - 1) if k > 1 else 0.0
+        for action in range(k):
+            rows = action_ptr[states] + action
+            action_target[rows] = neighbours[:, action]
+            row_nnz[rows] = k
+            positions = entry_ptr[states][:, None] + action * k + np.arange(k)
+            indices[positions] = neighbours
+            data[positions] = np.where(np.arange(k) == action, success, other)
+    indptr = np.concatenate([[0], np.cumsum(row_nnz)]).astype(np.int64)
+    n = len(counts)
+    transitions = sparse.csr_matrix((data, indices, indptr), shape=(n_rows, n))
+    rows_of, cols_of = np.nonzero(open_cells)
+    names = [f"{prefix}x{i}y{j}" for i, j in zip(rows_of.tolist(), cols_of.tolist())]
+    return CompiledMDP(names, rewards[open_cells].astype(dtype), np.where(decision, DECISION, TERMINAL).astype(np.int8),
+                       np.where(decision, success, 0).astype(dtype), action_ptr, action_target, transitions)
@@ -0,0 +1,100 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# work counters of a solve: policy improvement rounds, value iteration sweeps (a sweep updates every state it covers),
+# Bellman backups of single states, exact linear solves, decision nodes that changed action and actions ruled out by
+# the bounds of the -bounds mode
+COUNTERS = ("rounds", "sweeps", "backups", "linear_solves", "policy_changes", "eliminated_actions")
+
+
+class SolveStats:
+    """Phase timers and work counters of one MDP. Timers are only started around whole phases (parse, compile,
+        evaluation, improvement, solve), never per state, so they are always on. Phases can nest: solve includes
+        the evaluation and improvement of its rounds"""
+
+    def __init__(self):
+        self.timers = OrderedDict()
+        self.counters = OrderedDict((name, 0) for name in COUNTERS)
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+    def reset(self, *phases):
+        """Clears the counters and the given phase timers, the others (parse, compile) describe the model"""
+        for phase in phases:
+            self.timers.pop(phase, None)
+        self.counters = OrderedDict((name, 0) for name in COUNTERS)
+
+    def to_dict(self):
+        return {"seconds": {phase: round(seconds, 6) for phase, seconds in self.timers.items()},
+                **self.counters}
+
+    def __str__(self):
+        lines = [f"{phase:<18} {seconds * 1000:>12.3f} ms" for phase, seconds in self.timers.items()]
+        lines += [f"{name:<18} {count:>12}" for name, count in self.counters.items()]
+        return "\n".join(lines)
+
+
+def timed(phase):
+    """Decorator adding the run time of an MDP method (or of a static method taking the MDP first) to a phase timer"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(mdp, *args, **kwargs):
+            with mdp.stats.timer(phase):
+                return method(mdp, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Metrics:
+    """Totals of the stats of every solve in the process, rendered in the Prometheus text format"""
+
+    def __init__(self, prefix="mdp"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.solves = OrderedDict()
+        self.seconds = OrderedDict()
+        self.counters = OrderedDict((name, 0) for name in COUNTERS)
+
+    def observe(self, stats, solver="vi", success=True):
+        """Adds a solve, stats is the SolveStats.to_dict() of its MDP (or None when it failed)"""
+        with self.lock:
+            key = (solver, "success" if success else "error")
+            self.solves[key] = self.solves.get(key, 0) + 1
+            if stats is None:
+                return
+            for phase, seconds in stats["seconds"].items():
+                self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+            for name in COUNTERS:
+                self.counters[name] += stats.get(name, 0)
+
+    def prometheus(self, extra=None):
+        """The metrics as Prometheus text, extra is an optional {name: (help, type, value)} dict of other metrics"""
+        p = self.prefix
+        with self.lock:
+            lines = [f"# HELP {p}_solves_total Solves by solver and outcome", f"# TYPE {p}_solves_total counter"]
+            lines += [f'{p}_solves_total{{solver="{solver}",status="{status}"}} {count}'
+                      for (solver, status), count in self.solves.items()]
+            lines += [f"# HELP {p}_phase_seconds_total Seconds spent in each phase",
+                      f"# TYPE {p}_phase_seconds_total counter"]
+            lines += [f'{p}_phase_seconds_total{{phase="{phase}"}} {seconds:.6f}'
+                      for phase, seconds in self.seconds.items()]
+            for name, count in self.counters.items():
+                lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {count}"]
+        for name, (description, kind, value) in (extra or {}).items():
+            lines += [f"# HELP {p}_{name} {description}", f"# TYPE {p}_{name} {kind}", f"{p}_{name} {value}"]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from queue import Full
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+def run_job(function, payload, connection):
+    """Entry point of a job process, sends (status, result or error) back through the connection"""
+    try:
+        connection.send((DONE, function(payload)))
+    except Exception as e:
+        connection.send((FAILED, f"{type(e).__name__}: {e}"))
+    finally:
+        connection.close()
+
+
+class Job:
+    """A submitted call of the queue function, its status and, once finished, its result or error"""
+
+    def __init__(self, payload):
+        self.id = uuid.uuid4().hex
+        self.payload = payload
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.process = None
+
+    def to_dict(self):
+        job = {"job_id": self.id, "status": self.status, "submitted": self.submitted, "started": self.started,
+               "finished": self.finished}
+        if self.status == DONE:
+            job["result"] = self.result
+        elif self.status == FAILED:
+            job["error"] = self.error
+        return job
+
+
+def default_start_method():
+    """The start method of the job processes: forkserver where there is one, else spawn"""
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class JobQueue:
+    """Runs function(payload) for submitted jobs in their own processes, at most `workers` at a time.
+        function and the payloads must be picklable"""
+
+    def __init__(self, function, workers=None, max_queued=64, max_finished=1000, on_finish=None, start_method=None):
+        self.function = function
+        self.on_finish = on_finish
+        self.context = multiprocessing.get_context(start_method or default_start_method())
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self.jobs = {}
+        self.pending = deque()
+        self.finished = deque()
+        self.lock = threading.Condition()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, payload):
+        with self.lock:
+            if len(self.pending) >= self.max_queued:
+                raise Full(f"{len(self.pending)} jobs are already queued")
+            job = Job(payload)
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.lock.notify()
+            return job.to_dict()
+
+    def get(self, job_id):
+        """The job as a dict, None for unknown (or long finished) jobs"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def cancel(self, job_id):
+        """Cancels a queued or running job, finished jobs are left as they are. Returns the job as a dict"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                self.pending.remove(job)
+                job.status = CANCELLED
+                self._finish(job)
+            elif job.status == RUNNING:
+                # the worker sees the closed connection and finishes the job. A process that is still starting is
+                # terminated by the worker once it started
+                job.status = CANCELLED
+                if job.process is not None:
+                    job.process.terminate()
+            return job.to_dict()
+
+    def stats(self):
+        with self.lock:
+            counts = OrderedDict((status, 0) for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED))
+            for job in self.jobs.values():
+                counts[job.status] += 1
+            return {"workers": self.workers, "max_queued": self.max_queued, "jobs": counts}
+
+    def _finish(self, job):
+        job.finished = time.time()
+        job.payload = job.process = None
+        self.finished.append(job)
+        while len(self.finished) > self.max_finished:
+            del self.jobs[self.finished.popleft().id]
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                job = self.pending.popleft()
+                job.status = RUNNING
+                job.started = time.time()
+            # starting a process takes a while, the queue stays usable meanwhile
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(target=run_job, args=(self.function, job.payload, sender), daemon=True)
+            process.start()
+            sender.close()
+            with self.lock:
+                job.process = process
+                if job.status == CANCELLED:
+                    process.terminate()
+            try:
+                status, value = receiver.recv()
+            except EOFError:
+                status = None
+            receiver.close()
+            process.join()
+            if status is None:
+                status, value = FAILED, f"the job process exited with code {process.exitcode}"
+            with self.lock:
+                payload = job.payload
+                if job.status == RUNNING:
+                    job.status = status
+                    if status == DONE:
+                        job.result = value
+                    else:
+                        job.error = value
+                self._finish(job)
+                finished = job.to_dict() if job.status in (DONE, FAILED) else None
+            if finished and self.on_finish:
+                self.on_finish(finished, payload)
@@ -3,6 +3,15 @@ import argparse
 from decimal import Decimal
 import sys
 import random
+import time
+from array import array
+from contextlib import contextmanager
+import numpy as np
+from scipy import sparse
+from compiled import CompiledMDP, NODE_CLASSES, CHANCE, DECISION, TERMINAL, transition_rows
+from grids import parse_grid
+from instrumentation import SolveStats, timed
+from parallel import SweepPool
 
 comment = re.compile(r"^#.*$")
 # reward lines are of the form 'name = value' where value is an integer
@@ -12,14 +21,24 @@ edge_line = re.compile(f"^[a-zA-Z0-9\-']+ *: *\[ *([a-zA-Z0-9\-']*) *(, *[a-zA-Z
 # probabilities are of the form 'name % p1 p2 p3'
 probability_line = re.compile(f"^[a-zA-Z0-9\-']+ *% * (\.?[0-9]*| *)*$")
 debug = False
+# Python number type used for rewards, probabilities and values in each precision mode
+PRECISIONS = {"float64": float, "float32": float, "decimal": Decimal}
+# array dtype used by the sparse backend for the float precisions
+DTYPES = {"float64": np.float64, "float32": np.float32}
+# 'vi': value iteration under the current policy alternated with greedy improvement
+# 'pi': policy iteration with exact (sparse linear solve) policy evaluation
+# 'ps': prioritized sweeping, asynchronous in place Bellman backups ordered by residual
+# 'scc': strongly connected components solved one at a time in reverse topological order
+# 'mpi': modified policy iteration, k evaluation sweeps after every greedy improvement
+SOLVERS = ("vi", "pi", "ps", "scc", "mpi")
 
 
-def tokenize(line):
+def tokenize(line, number=Decimal):
     """Separates the node name and the rest of the values depending on the type of the line"""
     if "=" in line:
         # tokenize the reward line
         tokens = [x.strip() for x in line.split("=")]
-        return tokens[0], Decimal(tokens[1])
+        return tokens[0], number(tokens[1])
     if ":" in line:
         # tokenize the edge line
         tokens = [x.strip() for x in line.split(":")]
@@ -31,15 +50,155 @@ def tokenize(line):
         return tokens[0], probabilities
 
 
-def print_d(*args, **kwargs):
-    """Function to print stuff if we are in debug mode"""
+def parse_stream(stream, dtype=np.float64):
+    """Single pass parser for very large files, returns a CompiledMDP and a dict of parse statistics.
+        The lines are read one at a time and every line is checked against the one regex its separator allows.
+        State names are interned to integer ids as they appear (names only used as edges become terminal nodes
+        with reward 0) and probability lines are kept in a compact side buffer until all the edges are known.
+        No Node objects are created. '@grid' blocks are compiled on their own (see grids.parse_grid) and appended,
+        the other lines can only use their cells as edges."""
+    start_time = time.perf_counter()
+    index, names, rewards, successors, edge_order = {}, [], [], [], []
+    prob_state, prob_ptr, prob_values = array("q"), array("q", [0]), array("d")
+    # the states with a reward, edge or probability line, and the compiled grid blocks
+    defined, grids = set(), []
+    n_lines = n_chars = 0
+
+    def intern(state_name):
+        state = index.get(state_name)
+        if state is None:
+            state = index[state_name] = len(names)
+            names.append(state_name)
+            rewards.append(0.0)
+            successors.append([])
+            edge_order.append([])
+        return state
+
+    stream = iter(stream)
+    for line in stream:
+        n_lines += 1
+        n_chars += len(line)
+        line = line.rstrip("\r\n")
+        if not line or line[0] == "#":
+            continue
+        if line.startswith("@grid"):
+            block = []
+            for block_line in stream:
+                n_lines += 1
+                n_chars += len(block_line)
+                if block_line.strip() == "@end":
+                    break
+                block.append(block_line)
+            else:
+                raise ValueError(f"Grid block without @end: {line}")
+            grids.append(parse_grid(line, block, dtype))
+        elif "=" in line:
+            if reward_line.match(line):
+                name, _, value = line.partition("=")
+                s = intern(name.strip())
+                rewards[s] = float(value)
+                defined.add(s)
+        elif ":" in line:
+            if edge_line.match(line):
+                name, _, targets = line.partition(":")
+                s = intern(name.strip())
+                defined.add(s)
+                order = edge_order[s] = [intern(t) for t in map(str.strip, targets.strip(" []").split(",")) if t]
+                successors[s] = list(dict.fromkeys(successors[s] + order if successors[s] else order))
+        elif "%" in line:
+            if probability_line.match(line):
+                name, _, values = line.partition("%")
+                prob_state.append(intern(name.strip()))
+                defined.add(prob_state[-1])
+                prob_values.extend(map(float, values.split()))
+                prob_ptr.append(len(prob_values))
+
+    n = len(names)
+    node_class, success_rate, probabilities = [CHANCE] * n, [0.0] * n, [None] * n
+    for k, s in enumerate(prob_state):
+        values = prob_values[prob_ptr[k]:prob_ptr[k + 1]]
+        if not successors[s]:
+            raise ValueError(f"Node {names[s]} has probabilities but no edges")
+        if len(values) == 1:
+            node_class[s], success_rate[s] = DECISION, values[0]
+            continue
+        if len(values) != len(edge_order[s]):
+            raise ValueError(f"Node {names[s]} has {len(edge_order[s])} edges but {len(values)} probabilities")
+        if abs(sum(values) - 1) > 1e-9:
+            raise ValueError(f"The probabilities of node {names[s]} don't add up to 1")
+        edge_probabilities = dict.fromkeys(successors[s], 0.0)
+        for t, p in zip(edge_order[s], values):
+            edge_probabilities[t] += p
+        node_class[s], probabilities[s] = CHANCE, list(edge_probabilities.values())
+    for s in range(n):
+        if not successors[s]:
+            node_class[s], probabilities[s] = TERMINAL, []
+        elif node_class[s] == CHANCE and probabilities[s] is None:
+            # edges without probabilities: a single edge is taken for sure, more edges make a decision node
+            if len(successors[s]) == 1:
+                probabilities[s] = [1.0]
+            else:
+                node_class[s], success_rate[s] = DECISION, 1.0
+    if grids:
+        compiled = with_grids(names, rewards, node_class, success_rate, successors, probabilities, defined, grids,
+                              dtype)
+    else:
+        compiled = CompiledMDP.build(names, rewards, node_class, success_rate, successors, probabilities, dtype)
+    seconds = time.perf_counter() - start_time
+    stats = {"lines": n_lines, "chars": n_chars, "states": len(compiled), "transitions": compiled.transitions.nnz,
+             "seconds": seconds, "lines_per_second": n_lines / seconds if seconds else float("inf")}
+    return compiled, stats
+
+
+def with_grids(names, rewards, node_class, success_rate, successors, probabilities, defined, grids,
+               dtype=np.float64):
+    """The CompiledMDP of parse_stream when the model has grid blocks: the states of the other lines first (without
+        the grid cells they only use as edges), then the cells of every grid block in order"""
+    grid_names = [name for grid in grids for name in grid.names]
+    grid_index = {name: i for i, name in enumerate(grid_names)}
+    if len(grid_index) != len(grid_names):
+        raise ValueError("Grid blocks define the same cell twice, give them different prefixes")
+    keep = [s for s, name in enumerate(names) if name not in grid_index]
+    for s in range(len(names)):
+        if names[s] in grid_index and s in defined:
+            raise ValueError(f"Node {names[s]} is a grid cell, it can't have its own lines")
+    ids = np.empty(len(names), dtype=np.int64)
+    ids[keep] = np.arange(len(keep))
+    for s, name in enumerate(names):
+        if name in grid_index:
+            ids[s] = len(keep) + grid_index[name]
+    n = len(keep) + len(grid_names)
+    action_ptr, action_target, rows = transition_rows([node_class[s] for s in keep], [success_rate[s] for s in keep],
+                                                      [ids[successors[s]].tolist() for s in keep],
+                                                      [probabilities[s] for s in keep], n, dtype)
+    tables, offset = [rows], len(keep)
+    for grid in grids:
+        matrix = grid.transitions
+        tables.append(sparse.csr_matrix((matrix.data, matrix.indices + offset, matrix.indptr),
+                                        shape=(matrix.shape[0], n)))
+        action_ptr = np.concatenate([action_ptr, grid.action_ptr[1:] + action_ptr[-1]])
+        action_target = np.concatenate([action_target, np.where(grid.action_target >= 0, grid.action_target + offset,
+                                                                -1)])
+        offset += len(grid)
+    return CompiledMDP([names[s] for s in keep] + grid_names,
+                       np.concatenate([np.array([rewards[s] for s in keep], dtype=dtype)] + [g.rewards for g in grids]),
+                       np.concatenate([np.array([node_class[s] for s in keep], dtype=np.int8)] +
+                                      [g.node_class for g in grids]),
+                       np.concatenate([np.array([success_rate[s] for s in keep], dtype=dtype)] +
+                                      [g.success_rate for g in grids]),
+                       action_ptr, action_target, sparse.vstack(tables, format="csr"))
+
+
+def print_d(message, *args):
+    """Function to print stuff if we are in debug mode, message % args is only formatted then"""
     if debug:
-        print(*args, **kwargs)
+        print(message % args if args else message)
 
 
 class Node:
     """This class represents a node in an MDP
         It can be a decision node, a terminal node or a chance node. """
+    __slots__ = ("name", "reward", "edges", "node_class", "success_rate", "value", "edge_order")
 
     def __init__(self, name, reward=Decimal(0), node_class="chance", edges=None, success_rate=None, val=Decimal(0),
                  edge_order=None):
@@ -75,15 +234,15 @@ class Node:
     def is_parent_of(self, possible_child):
         return possible_child.name in self.edges.keys()
 
-    def add_edges(self, neighbors):
+    def add_edges(self, neighbors, number=Decimal):
         self.edge_order = neighbors  # we need to keep the order of the edges. (this is specially important when there are duplicate edges)
         for e in neighbors:
-            self.edges[e.strip()] = Decimal(0)  # The default probability is 0
+            self.edges[e.strip()] = number(0)  # The default probability is 0
 
-    def add_probabilities(self, probabilities):
+    def add_probabilities(self, probabilities, number=Decimal):
         if len(probabilities) == 1:
-            success_rate = Decimal(probabilities[0])
-            prob_for_other_edges = (1 - success_rate) / (len(self.edges) - 1)
+            success_rate = number(probabilities[0])
+            prob_for_other_edges = (1 - success_rate) / (len(self.edges) - 1) if len(self.edges) > 1 else 0
             self.success_rate = success_rate
             self.node_class = "decision"
             # get the remaining probability and distribute it among the remaining edges
@@ -92,9 +251,10 @@ class Node:
         else:
             p_sum = 0
             for j, e in enumerate(self.edge_order):
-                p_sum += Decimal(probabilities[j])
-                self.edges[e] += Decimal(probabilities[j])
-            if p_sum != 1:
+                p_sum += number(probabilities[j])
+                self.edges[e] += number(probabilities[j])
+            # floats can't represent most probabilities exactly, so they only have to add up to 1 within rounding
+            if p_sum != 1 and (number is Decimal or abs(p_sum - 1) > 1e-9):
                 sys.exit(1)
 
     def __repr__(self):
@@ -109,6 +269,76 @@ class Node:
         return Node(self.name, self.reward, self.node_class, self.edges, self.success_rate, self.value)
 
 
+class NodeView:
+    """A node of a compact MDP (see MDP.compact). It holds only the MDP and the id of the state and reads everything
+        else from the compiled arrays, and its value from the value array of the MDP, so a state costs a few words
+        instead of a Node with its dicts. The edges of a decision node follow the current policy of the MDP"""
+    __slots__ = ("mdp", "id")
+
+    def __init__(self, mdp, state_id):
+        self.mdp = mdp
+        self.id = state_id
+
+    @property
+    def name(self):
+        return self.mdp.compiled.names[self.id]
+
+    @property
+    def reward(self):
+        return self.mdp.compiled.rewards[self.id].item()
+
+    @property
+    def node_class(self):
+        return NODE_CLASSES[self.mdp.compiled.node_class[self.id]]
+
+    @property
+    def success_rate(self):
+        return self.mdp.compiled.success_rate[self.id].item() if self.is_decision() else None
+
+    @property
+    def value(self):
+        return self.mdp.state_values[self.id].item()
+
+    @value.setter
+    def value(self, value):
+        self.mdp.state_values[self.id] = value
+
+    @property
+    def edges(self):
+        """A new {successor: probability} dict"""
+        compiled = self.mdp.compiled
+        row = compiled.action_ptr[self.id]
+        if compiled.node_class[self.id] == DECISION:
+            targets = [compiled.names[t] for t in compiled.action_target[row:compiled.action_ptr[self.id + 1]].tolist()]
+            action = self.mdp.policy.get(self.name, targets[0])
+            success_rate = compiled.success_rate[self.id].item()
+            failure = (1 - success_rate) / (len(targets) - 1) if len(targets) > 1 else 0
+            return {t: success_rate if t == action else failure for t in targets}
+        indptr, start = compiled.transitions.indptr, compiled.transitions.indptr[row]
+        return {compiled.names[t]: p for t, p in zip(compiled.transitions.indices[start:indptr[row + 1]].tolist(),
+                                                     compiled.transitions.data[start:indptr[row + 1]].tolist())}
+
+    @property
+    def edge_order(self):
+        return list(self.edges)
+
+    def is_decision(self):
+        return self.mdp.compiled.node_class[self.id] == DECISION
+
+    def is_terminal(self):
+        return self.mdp.compiled.node_class[self.id] == TERMINAL
+
+    actions = Node.actions
+    is_parent_of = Node.is_parent_of
+    __repr__ = Node.__repr__
+    __hash__ = Node.__hash__
+
+    def copy(self):
+        """A detached Node with the data of the state"""
+        edges = self.edges
+        return Node(self.name, self.reward, self.node_class, edges, self.success_rate, self.value, list(edges))
+
+
 class Policy(dict):
     """A class to specify the policy of an MDP. A Policy is simply a mapping between Decision nodes and Actions"""
 
@@ -149,9 +379,33 @@ class MDP(dict):
     """A class for an MDP.
         It contains methods for manipulating, solving and printing MDPs and MRPs"""
 
-    def __init__(self, df=1.0, policy=None, tol=0.01, max_iter=100, use_min=False):
-        """df: discount factor"""
+    def __init__(self, df=1.0, policy=None, tol=0.01, max_iter=100, use_min=False, backend="sparse",
+                 precision="float64", solver="vi", bounds=False, k=20, workers=1):
+        """df: discount factor
+            backend: 'sparse' runs the sweeps on the compiled arrays, 'python' backs up one Node at a time
+            precision: 'float64', 'float32' or 'decimal'. Decimal is exact and always uses the python backend
+            solver: one of SOLVERS
+            bounds: stop vi, pi and mpi on the MacQueen bounds of the optimal values and drop the actions they rule
+            out, needs df < 1 and the sparse backend
+            k: evaluation sweeps per improvement of the 'mpi' solver, 0 is value iteration
+            workers: processes running the sweeps and greedy backups of vi, pi and mpi on blocks of states, 1 runs
+            them in this process"""
         super(MDP, self).__init__()
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver '{solver}', expected one of {', '.join(SOLVERS)}")
+        if solver != "vi" and precision == "decimal":
+            raise ValueError(f"The '{solver}' solver needs a float precision")
+        if bounds and (solver not in ("vi", "pi", "mpi") or backend != "sparse" or precision == "decimal"):
+            raise ValueError("Bound-based termination needs the vi, pi or mpi solver, the sparse backend and a float "
+                             "precision")
+        if k < 0:
+            raise ValueError("k must be at least 0")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if workers > 1 and (solver not in ("vi", "pi", "mpi") or backend != "sparse" or precision == "decimal"):
+            raise ValueError("Parallel sweeps need the vi, pi or mpi solver, the sparse backend and a float precision")
         if policy is None:
             policy = Policy()
         self.policy = policy
@@ -159,27 +413,232 @@ class MDP(dict):
         self.tol = tol
         self.max_iter = max_iter
         self.use_min = use_min
+        self.backend = backend
+        self.precision = precision
+        self.number = PRECISIONS[precision]
+        self.solver = solver
+        self.bounds = bounds
+        self.k = int(k)
+        self.workers = int(workers)
+        # set by solve: whether the last solve met its stopping rule and the width of the MacQueen bounds on the
+        # optimal values around its result (None when df >= 1, where there are no such bounds)
+        self.converged = None
+        self.gap = None
+        self.compiled = None
+        # the values of a compact MDP, whose nodes are NodeViews, None while the MDP holds Nodes
+        self.state_values = None
+        self.parse_stats = None
+        self.stats = SolveStats()
 
     def copy(self):
-        new_mdp = MDP(self.df, self.policy, self.tol, self.max_iter, self.use_min)
+        new_mdp = MDP(self.df, self.policy, self.tol, self.max_iter, self.use_min, self.backend, self.precision,
+                      self.solver, self.bounds, self.k, self.workers)
+        new_mdp.compiled = self.compiled
+        if self.state_values is not None:
+            new_mdp.state_values = self.state_values.copy()
+            dict.update(new_mdp, ((name, NodeView(new_mdp, node.id)) for name, node in self.items()))
+            return new_mdp
         for k, v in self.items():
             new_mdp[k] = v
         return new_mdp
 
-    def solve(self):
-        """Solves the MDP using value iteration and greedy policy iteration"""
+    def uses_arrays(self):
+        """True when the sweeps and the policy improvement run on the compiled arrays"""
+        return self.backend == "sparse" and self.precision != "decimal"
+
+    @timed("compile")
+    def compile(self):
+        """Builds (or rebuilds) the array form of the MDP used by the sparse backend.
+            The arrays of a compact MDP are its data, so they are kept"""
+        if self.state_values is not None:
+            return self.compiled
+        self.compiled = CompiledMDP.from_mdp(self, DTYPES.get(self.precision, np.float64))
+        return self.compiled
+
+    def compact(self):
+        """Replaces the Nodes by NodeViews onto the compiled arrays, keeping the values. The model then costs the
+            compiled arrays, a value array and a small view per state. Only for the sparse backend"""
+        if self.state_values is not None:
+            return
+        compiled = self.compiled or self.compile()
+        values = self.node_values()
+        self.clear()
+        self.state_values = values
+        dict.update(self, ((name, NodeView(self, s)) for s, name in enumerate(compiled.names)))
+
+    def load_compiled(self, compiled):
+        """Creates the nodes of a CompiledMDP, which is kept as the array form of this MDP. With the sparse backend
+            the MDP is compact, with NodeViews starting at 0 instead of Nodes"""
+        if self.uses_arrays():
+            self.clear()
+            self.compiled = compiled
+            self.state_values = np.zeros(len(compiled), dtype=compiled.dtype)
+            dict.update(self, ((name, NodeView(self, s)) for s, name in enumerate(compiled.names)))
+            return
+        indptr, indices, data = compiled.transitions.indptr, compiled.transitions.indices, compiled.transitions.data
+        number = self.number
+        for s, name in enumerate(compiled.names):
+            row = compiled.action_ptr[s]
+            success_rate = None
+            if compiled.node_class[s] == DECISION:
+                targets = compiled.action_target[row:compiled.action_ptr[s + 1]].tolist()
+                edges = {compiled.names[t]: number(0) for t in targets}
+                success_rate = number(compiled.success_rate[s].item())
+            else:
+                row = slice(indptr[row], indptr[row + 1])
+                edges = {compiled.names[t]: number(p) for t, p in zip(indices[row].tolist(), data[row].tolist())}
+            self[name] = Node(name, number(compiled.rewards[s].item()), NODE_CLASSES[compiled.node_class[s]], edges,
+                              success_rate, number(0), list(edges))
+        self.compiled = compiled
+
+    def node_values(self):
+        """The current values of the Nodes as an array in compiled order"""
+        compiled = self.compiled or self.compile()
+        if self.state_values is not None:
+            return self.state_values.copy()
+        return np.array([float(self[name].value) for name in compiled.names], dtype=compiled.dtype)
+
+    def set_node_values(self, values):
+        if self.state_values is not None:
+            self.state_values = np.asarray(values, dtype=self.compiled.dtype)
+            return
+        for name, v in zip(self.compiled.names, values.tolist()):
+            self[name].value = v
+
+    @timed("solve")
+    def solve(self, progress=None):
+        """Solves the MDP using value iteration and greedy policy iteration.
+            progress: optional callback, called after every policy improvement round with a dict of the round number
+            ('iteration'), the largest Bellman residual of the values ('residual', None with the per node backend),
+            the number of decision nodes that changed action ('policy_changes') and the seconds since the start
+            ('elapsed') and the current bound gap ('gap'). ps and scc report once, when they are done. When it returns
+            True the solve stops after that round with the current values and their greedy policy.
+            The phase times and work counters of the solve are left in self.stats, whether it met its stopping rule
+            in self.converged and the width of the bounds on the optimal values around the result in self.gap"""
+        self.stats.reset("solve", "evaluation", "improvement")
+        self.converged = self.gap = None
+        if self.bounds and float(self.df) >= 1:
+            raise ValueError("Bound-based termination needs a discount factor below 1")
+        if self.solver == "pi":
+            self.exact_policy_iteration(progress)
+            return
+        if self.solver == "ps":
+            self.prioritized_sweeping(progress)
+            return
+        if self.solver == "scc":
+            self.scc_solve(progress)
+            return
+        if self.solver == "mpi":
+            self.modified_policy_iteration(progress)
+            return
+        if self.uses_arrays():
+            self.sparse_solve(progress)
+            return
+        start = time.perf_counter()
         current_policy = self.policy.copy()
+        iteration = 0
         while True:
-            self.value_iteration()
-            self.policy_iteration()
+            with self.stats.timer("evaluation"):
+                self.value_iteration()
+            with self.stats.timer("improvement"):
+                self.policy_iteration()
             previous_policy = current_policy.copy()
             current_policy = self.policy.copy()
             self.apply_policy(self.policy)
-            if previous_policy == current_policy:
+            iteration += 1
+            changes = sum(previous_policy.get(name) != action for name, action in current_policy.items())
+            self.count_round(changes)
+            if self.report_progress(progress, start, iteration, None, changes) or previous_policy == current_policy:
                 break
         self.apply_policy(self.policy)
+        self.converged = self.converged and previous_policy == current_policy
+        self.compile()
+        self.gap = self.bound_gap(self.node_values())
+
+    def count_round(self, policy_changes, sweeps=0, backups=0, linear_solves=0):
+        """Adds a policy improvement round, and the evaluation work before it, to the stats"""
+        stats = self.stats
+        stats.count("rounds")
+        stats.count("policy_changes", policy_changes)
+        stats.count("sweeps", sweeps)
+        stats.count("backups", backups)
+        stats.count("linear_solves", linear_solves)
+
+    def report_progress(self, progress, start, iteration, values, policy_changes):
+        """Calls the progress callback of solve(), returns True when it asks to stop"""
+        if progress is None:
+            return False
+        residual = None
+        if values is not None:
+            residual = float(np.max(np.abs(self.compiled.bellman(values, float(self.df), self.use_min) - values),
+                                    initial=0))
+        return bool(progress({"solver": self.solver, "iteration": iteration, "residual": residual,
+                              "policy_changes": int(policy_changes), "elapsed": time.perf_counter() - start,
+                              "gap": self.gap}))
+
+    def bound_gap(self, values, backed_up=None):
+        """Width of the MacQueen bounds on the optimal values around values (see CompiledMDP.value_bounds), None when
+            df >= 1. backed_up is the Bellman backup of the values when it is already known"""
+        df = float(self.df)
+        if df >= 1:
+            return None
+        if backed_up is None:
+            backed_up = self.compiled.bellman(values, df, self.use_min)
+        lower, upper = CompiledMDP.value_bounds(values, backed_up, df)
+        return float(np.max(upper - lower, initial=0))
+
+    @contextmanager
+    def sweeper(self, compiled):
+        """What runs the sweeps and the greedy backups of a solve: a SweepPool of self.workers processes, or with a
+            single worker the compiled arrays themselves, which have the same methods"""
+        if self.workers == 1:
+            yield compiled
+            return
+        with SweepPool(compiled, self.workers) as pool:
+            yield pool
+
+    def improve(self, table, values, sweeper=None):
+        """The greedy improvement of vi and pi over the rows of table: self.compiled or, with self.bounds, what is left
+            of it once the rows the bounds rule out are dropped, so later rounds back up fewer actions. Returns the
+            greedy rows (rows of self.compiled), the table for the next round and the Bellman backup of the values.
+            The backup runs on sweeper while table is the whole of self.compiled. Sets self.gap"""
+        df = float(self.df)
+        source = sweeper if sweeper is not None and table is self.compiled else table
+        rows, backed_up = source.greedy(values, df, self.use_min)
+        compiled_rows = rows if table.row_ids is None else table.row_ids[rows]
+        if df >= 1:
+            return compiled_rows, table, backed_up
+        lower, upper = CompiledMDP.value_bounds(values, backed_up, df)
+        self.gap = float(np.max(upper - lower, initial=0))
+        if self.bounds:
+            keep = table.optimal_rows(lower, upper, df, self.use_min)
+            keep[rows] = True
+            if not keep.all():
+                self.stats.count("eliminated_actions", len(keep) - np.count_nonzero(keep))
+                table = table.restrict(keep)
+        return compiled_rows, table, backed_up
+
+    def bounds_solution(self, table, rows, values, backed_up):
+        """The final values of a -bounds solve after an improvement step to rows, None while it has to go on. When a
+            single action is left in every state the policy is optimal and is evaluated exactly, when the bounds are
+            within tol their middle, which is closer to the optimal values than either end, is taken"""
+        compiled = self.compiled
+        if len(table.action_target) == len(compiled):
+            with self.stats.timer("evaluation"):
+                values = compiled.evaluate_policy(rows, values, float(self.df), float(self.tol), self.max_iter)
+            self.stats.count("linear_solves")
+            self.gap = self.bound_gap(values)
+            return values
+        if self.gap <= self.tol:
+            lower, upper = CompiledMDP.value_bounds(values, backed_up, float(self.df))
+            return (lower + upper) / 2
+        return None
 
     def apply_policy(self, policy):
+        """Sets the edge probabilities of the decision nodes for the policy. The NodeViews of a compact MDP always
+            follow self.policy"""
+        if self.state_values is not None:
+            return
         for node in self.values():
             if node.is_decision():
                 for e in node.edges.keys():
@@ -188,29 +647,336 @@ class MDP(dict):
                     else:
                         node.edges[e] = (1 - node.success_rate) / (len(node.edges) - 1)
 
+    def exact_policy_iteration(self, progress=None):
+        """Policy iteration where every policy is evaluated exactly with a sparse linear solve"""
+        if not self.policy:
+            self.policy = Policy.random_policy(self)
+        compiled = self.compiled or self.compile()
+        start = time.perf_counter()
+        rows = compiled.policy_rows(self.policy)
+        values = self.node_values()
+        table = compiled
+        iter_num = 0
+        with self.sweeper(compiled) as sweeper:
+            while True:
+                with self.stats.timer("evaluation"):
+                    values = compiled.evaluate_policy(rows, values, float(self.df), float(self.tol), self.max_iter)
+                with self.stats.timer("improvement"):
+                    new_rows, table, backed_up = self.improve(table, values, sweeper)
+                changes = np.count_nonzero(rows != new_rows)
+                # the improvement backs up every state once
+                self.count_round(changes, backups=len(compiled), linear_solves=1)
+                stop = self.report_progress(progress, start, iter_num + 1, values, changes)
+                self.converged = np.array_equal(rows, new_rows)
+                if self.bounds and not self.converged:
+                    final = self.bounds_solution(table, new_rows, values, backed_up)
+                    if final is not None:
+                        values, self.converged = final, True
+                # ties could make two equally good policies alternate forever, max_iter bounds the number of rounds
+                if self.converged or iter_num >= self.max_iter or stop:
+                    print_d(f"Exact policy iteration stopped after iteration: {iter_num}")
+                    break
+                rows = new_rows
+                iter_num += 1
+        self.set_node_values(values)
+        self.policy = Policy(compiled.policy_from_rows(new_rows))
+        self.apply_policy(self.policy)
+
+    def modified_policy_iteration(self, progress=None):
+        """Every round improves the policy greedily, which is one Bellman backup of the values, then does k sweeps
+            v = r + df * P_pi v under the new policy. k = 0 is value iteration, and as k grows each round gets closer
+            to a full policy evaluation, that is to policy iteration. Stops when the Bellman residual is at most tol
+            (with self.bounds, as sparse_solve does) or after max_iter rounds"""
+        if not self.policy:
+            self.policy = Policy.random_policy(self)
+        compiled = self.compiled or self.compile()
+        start = time.perf_counter()
+        rows = compiled.policy_rows(self.policy)
+        values = self.node_values()
+        table = compiled
+        df, tol = float(self.df), float(self.tol)
+        self.converged = False
+        iteration = 0
+        with self.sweeper(compiled) as sweeper:
+            while True:
+                with self.stats.timer("improvement"):
+                    new_rows, table, backed_up = self.improve(table, values, sweeper)
+                changes = np.count_nonzero(rows != new_rows)
+                rows = new_rows
+                iteration += 1
+                stop = self.report_progress(progress, start, iteration, values, changes)
+                if self.bounds:
+                    final = self.bounds_solution(table, rows, values, backed_up)
+                    if final is not None:
+                        values, self.converged = final, True
+                elif np.max(np.abs(backed_up - values), initial=0) <= tol:
+                    values, self.converged = backed_up, True
+                if self.converged or iteration >= self.max_iter or stop:
+                    self.count_round(changes, backups=len(compiled))
+                    break
+                # the backup is already the first sweep under the greedy policy
+                iter_num = -1
+                values = backed_up
+                if self.k:
+                    with self.stats.timer("evaluation"):
+                        values, iter_num = sweeper.value_iteration(rows, values, df, tol, self.k - 1)
+                self.count_round(changes, sweeps=iter_num + 1, backups=(iter_num + 2) * len(compiled))
+        print_d(f"Modified policy iteration stopped after round: {iteration}")
+        self.set_node_values(values)
+        self.policy = Policy(compiled.policy_from_rows(rows))
+        self.apply_policy(self.policy)
+
+    def prioritized_sweeping(self, progress=None):
+        """Solves the Bellman optimality equation with asynchronous backups and reads the greedy policy off the values"""
+        compiled = self.compiled or self.compile()
+        start = time.perf_counter()
+        with self.stats.timer("evaluation"):
+            values, backups = compiled.prioritized_sweeping(self.node_values(), float(self.df), float(self.tol),
+                                                            self.max_iter, self.use_min)
+        print_d(f"Prioritized sweeping stopped after {backups} backups")
+        self.stats.count("backups", backups)
+        # the search only runs out of budget while some residual is still above tol
+        self.converged = backups < self.max_iter * len(compiled)
+        self.set_greedy_solution(values, progress, start)
+
+    def scc_solve(self, progress=None):
+        """Solves the strongly connected components of the model in reverse topological order"""
+        compiled = self.compiled or self.compile()
+        start = time.perf_counter()
+        with self.stats.timer("evaluation"):
+            values, stats = compiled.scc_solve(self.node_values(), float(self.df), float(self.tol), self.max_iter,
+                                               self.use_min)
+        print_d(f"SCC solve: {stats}")
+        self.stats.count("sweeps", stats["sweeps"])
+        self.stats.count("backups", stats["backups"])
+        self.converged = stats["unconverged_components"] == 0
+        self.set_greedy_solution(values, progress, start)
+
+    def set_greedy_solution(self, values, progress=None, start=None):
+        """Stores optimal values on the Nodes and the greedy policy they imply, reporting it as a single round"""
+        compiled = self.compiled
+        with self.stats.timer("improvement"):
+            rows, backed_up = compiled.greedy(values, float(self.df), self.use_min)
+        self.gap = self.bound_gap(values, backed_up)
+        previous = compiled.policy_rows(self.policy) if self.policy else compiled.action_ptr[:-1]
+        changes = np.count_nonzero(previous != rows)
+        self.count_round(changes, backups=len(compiled))
+        if progress is not None:
+            self.report_progress(progress, start, 1, values, changes)
+        self.set_node_values(values)
+        self.policy = Policy(compiled.policy_from_rows(rows))
+        self.apply_policy(self.policy)
+
+    def sweep_parameters(self, dfs, minimize=(False,)):
+        """Solves the model for every combination of discount factor and minimize flag at once, sharing the compiled
+            model and the sweeps (see CompiledMDP.batch_solve). Returns one (df, use_min, Policy, values) tuple per
+            configuration, values being a {name: value} dict. The MDP itself is left untouched"""
+        if self.precision == "decimal":
+            raise ValueError("Parameter sweeps need a float precision")
+        if not self.policy:
+            self.policy = Policy.random_policy(self)
+        compiled = self.compiled or self.compile()
+        configurations = [(float(df), bool(use_min)) for use_min in minimize for df in dfs]
+        k = len(configurations)
+        start_rows = compiled.policy_rows(self.policy)
+        rows, values, rounds = compiled.batch_solve(np.repeat(start_rows[:, None], k, axis=1),
+                                                    np.repeat(self.node_values()[:, None], k, axis=1),
+                                                    [df for df, _ in configurations],
+                                                    [use_min for _, use_min in configurations],
+                                                    float(self.tol), self.max_iter)
+        print_d(f"Parameter sweep of {k} configurations took {rounds} improvement rounds")
+        return [(df, use_min, Policy(compiled.policy_from_rows(rows[:, j])),
+                 dict(zip(compiled.names, values[:, j].tolist())))
+                for j, (df, use_min) in enumerate(configurations)]
+
+    @staticmethod
+    def print_sweep(results):
+        """Prints the policies and the values of a parameter sweep as two tables, one column per configuration"""
+        headers = [f"df={df}{' min' if use_min else ''}" for df, use_min, _, _ in results]
+        decision_nodes = sorted(results[0][2].keys()) if results else []
+        node_names = sorted(results[0][3].keys()) if results else []
+        width = max([len(h) for h in headers] + [len(name) for name in node_names] + [8])
+        print(" ".join(["policy".ljust(width)] + [h.ljust(width) for h in headers]))
+        for name in decision_nodes:
+            print(" ".join([name.ljust(width)] + [policy[name].ljust(width) for _, _, policy, _ in results]))
+        print()
+        print(" ".join(["value".ljust(width)] + [h.ljust(width) for h in headers]))
+        for name in node_names:
+            print(" ".join([name.ljust(width)] + [('%.3f' % round(values[name], 3)).ljust(width)
+                                                  for _, _, _, values in results]))
+
+    def update(self, lines):
+        """Applies edited lines of the input format to the model and returns the names of the nodes they touch.
+            A reward line sets the reward and an edge line replaces the edges of its node, dropping its probabilities,
+            so the probability line of a node has to be sent again whenever its edges change. New nodes start at 0"""
+        number = self.number
+        compact = self.state_values is not None
+        # the Nodes being edited, detached copies for the NodeViews of a compact MDP
+        nodes = {}
+
+        def node(node_name):
+            if node_name not in nodes:
+                if node_name in self:
+                    nodes[node_name] = self[node_name].copy() if compact else self[node_name]
+                else:
+                    nodes[node_name] = Node(node_name, number(0), val=number(0))
+                    if not compact:
+                        self[node_name] = nodes[node_name]
+            return nodes[node_name]
+
+        touched, probability_lines = {}, []
+        for line in lines:
+            line = line.strip()
+            if reward_line.match(line):
+                node_name, reward_value = tokenize(line, number)
+                node(node_name).reward = reward_value
+            elif edge_line.match(line):
+                node_name, neighbors = tokenize(line, number)
+                edited = node(node_name)
+                edited.edges, edited.node_class, edited.success_rate = {}, "chance", None
+                edited.add_edges(neighbors, number)
+            elif probability_line.match(line):
+                probability_lines.append(line)
+                continue
+            else:
+                continue
+            touched[node_name] = True
+        for line in probability_lines:
+            # after the edges, so the lines of a node can come in any order
+            node_name, probabilities = tokenize(line, number)
+            node(node_name).add_probabilities(probabilities, number)
+            touched[node_name] = True
+        if not touched:
+            return []
+        MDP.classify_nodes(nodes[node_name] for node_name in touched)
+        if self.compiled is not None:
+            # patch the rows of the touched nodes instead of compiling the whole model again
+            names = list(self.keys())
+            if compact:
+                names += [node_name for node_name in nodes if node_name not in self]
+            index = dict(self.compiled.index)
+            index.update((name, i) for i, name in enumerate(names[len(index):], len(index)))
+            self.compiled = self.compiled.with_states(names, {index[node_name]: CompiledMDP.node_entry(nodes[node_name], index)
+                                                              for node_name in touched})
+            if compact and len(names) > len(self.state_values):
+                self.state_values = np.concatenate([self.state_values,
+                                                    np.zeros(len(names) - len(self.state_values), self.compiled.dtype)])
+                dict.update(self, ((name, NodeView(self, index[name])) for name in names[len(self):]))
+        return list(touched)
+
+    def resolve(self, lines):
+        """Incremental re-solve after an edit. The changed lines are applied with update(), then prioritized sweeping
+            starts from the current values with only the edited nodes queued, so the change is propagated only through
+            the states it affects. Decision nodes keep their current action while it is still one of the best.
+            Returns the number of Bellman backups"""
+        if self.precision == "decimal":
+            raise ValueError("Incremental solves need a float precision")
+        self.compiled or self.compile()
+        touched = self.update(lines)
+        if not touched:
+            return 0
+        compiled = self.compiled
+        current = compiled.policy_rows({k: v for k, v in self.policy.items()
+                                        if k in compiled.index and self[k].is_decision() and v in self[k].edges})
+        values, backups = compiled.prioritized_sweeping(self.node_values(), float(self.df), float(self.tol),
+                                                        self.max_iter, self.use_min,
+                                                        seeds=[compiled.index[name] for name in touched])
+        print_d(f"Incremental solve of {len(touched)} edited nodes took {backups} backups")
+        rows, backed_up = compiled.greedy(values, float(self.df), self.use_min, current)
+        self.converged = backups < self.max_iter * len(compiled)
+        self.gap = self.bound_gap(values, backed_up)
+        self.set_node_values(values)
+        self.policy = Policy(compiled.policy_from_rows(rows))
+        self.apply_policy(self.policy)
+        return backups
+
+    def sparse_solve(self, progress=None):
+        """The value iteration / greedy improvement loop of solve() on the compiled arrays.
+            The policy is kept as one row per state and only turned back into a Policy at the end"""
+        if not self.policy:
+            self.policy = Policy.random_policy(self)
+        compiled = self.compiled or self.compile()
+        start = time.perf_counter()
+        rows = compiled.policy_rows(self.policy)
+        values = self.node_values()
+        table = compiled
+        df, tol = float(self.df), float(self.tol)
+        sweep_tol = tol
+        self.converged = False
+        iteration = 0
+        with self.sweeper(compiled) as sweeper:
+            while True:
+                with self.stats.timer("evaluation"):
+                    values, iter_num = sweeper.value_iteration(rows, values, df, sweep_tol, self.max_iter)
+                with self.stats.timer("improvement"):
+                    new_rows, table, backed_up = self.improve(table, values, sweeper)
+                changes = np.count_nonzero(rows != new_rows)
+                print_d(f"Value iteration stopped after iteration: {iter_num}, policy changes: {changes}")
+                # every sweep and the improvement back up every state once
+                self.count_round(changes, sweeps=iter_num + 1, backups=(iter_num + 2) * len(compiled))
+                iteration += 1
+                stop = self.report_progress(progress, start, iteration, values, changes)
+                stable = np.array_equal(rows, new_rows)
+                if not self.bounds:
+                    # the sweeps give up after max_iter, leaving the values short of tol
+                    self.converged = stable and iter_num < self.max_iter
+                    if stable:
+                        break
+                else:
+                    final = self.bounds_solution(table, new_rows, values, backed_up)
+                    if final is not None:
+                        rows, values, self.converged = new_rows, final, True
+                        break
+                    if stable:
+                        # sweeps to tol left the bounds wider than tol: sweep closer, to a Bellman residual that makes
+                        # them at most df * tol wide
+                        if sweep_tol < tol:
+                            break
+                        sweep_tol = tol * (1 - df) / (2 * df)
+                    elif iteration >= self.max_iter:
+                        break
+                rows = new_rows
+                if stop:
+                    break
+        self.set_node_values(values)
+        self.policy = Policy(compiled.policy_from_rows(rows))
+        self.apply_policy(self.policy)
+
+    def sparse_policy_iteration(self):
+        """Greedy improvement of every decision node with one batched Q value evaluation"""
+        if not self.policy:
+            self.policy = Policy.random_policy(self)
+        compiled = self.compiled or self.compile()
+        rows = compiled.greedy_rows(self.node_values(), float(self.df), self.use_min)
+        self.policy = Policy(compiled.policy_from_rows(rows))
+
     def policy_iteration(self):
         print_d(f"Going into Policy Iteration:")
+        if self.uses_arrays():
+            self.sparse_policy_iteration()
+            return
         if not self.policy:
             self.policy = Policy.random_policy(self)
         current_policy = self.policy.copy()
         iter_num = 0
         while True:
             new_policy = current_policy.copy()
+            self.stats.count("backups", len(self))
             for node in self.values():
                 best_action = None
                 best_action_value = float("-inf")
                 if self.use_min:
                     best_action_value = float("+inf")
                 if node.is_decision():
-                    print_d(f"Looking for best action in {node.name}")
+                    print_d("Looking for best action in %s", node.name)
                     for action, probabilities in node.actions():
                         new_policy[node.name] = action
-                        print_d(f"\tTesting Policy: {node.name} -> {action}")
+                        print_d("\tTesting Policy: %s -> %s", node.name, action)
                         action_value = self.value(node, new_policy)
-                        print_d(f"\t\t\tAction {node.name} -> {action} has a value of {action_value}")
+                        print_d("\t\t\tAction %s -> %s has a value of %s", node.name, action, action_value)
                         if (best_action_value < action_value and not self.use_min) or (
                                 best_action_value > action_value and self.use_min):
-                            print_d(f"\tBest Action at {node.name}: {node.name} -> {action}")
+                            print_d("\tBest Action at %s: %s -> %s", node.name, node.name, action)
                             best_action_value = action_value
                             best_action = action
                     if best_action:
@@ -231,6 +997,9 @@ class MDP(dict):
     def value_iteration(self):
         print_d(f"Going into Value Iteration:")
         print_d(f"Using policy: {self.policy}")
+        if self.uses_arrays():
+            self.sparse_value_iteration()
+            return
         current_values = {k: v.value for k, v in self.items()}
         iter_num = 0
         if not self.policy:
@@ -239,6 +1008,8 @@ class MDP(dict):
             new_values = {}
             for node in self.values():
                 new_values[node] = self.value(node, self.policy)
+            self.stats.count("sweeps")
+            self.stats.count("backups", len(new_values))
             previous_values = current_values.copy()
             for node in new_values.keys():
                 self[node.name].value = new_values[node]
@@ -252,6 +1023,7 @@ class MDP(dict):
                 if abs(previous_values[a] - current_values[b]) > self.tol:
                     values_converge = False
             if values_converge or iter_num >= self.max_iter:
+                self.converged = values_converge
                 print_d(f"The values ARE equal. Iteration: {iter_num}")
                 print_d(f"Previous values: {previous_values}")
                 print_d(f"Current values: {current_values}")
@@ -261,71 +1033,149 @@ class MDP(dict):
             print_d(f"Current values: {current_values}")
             iter_num += 1
 
+    def sparse_value_iteration(self):
+        """Value iteration as one sparse mat-vec per sweep. The Nodes are only read before and written after the sweeps"""
+        if not self.policy:
+            self.policy = Policy.random_policy(self)
+        compiled = self.compiled or self.compile()
+        rows = compiled.policy_rows(self.policy)
+        values, iter_num = compiled.value_iteration(rows, self.node_values(), float(self.df), float(self.tol),
+                                                    self.max_iter)
+        print_d(f"Sparse value iteration stopped after iteration: {iter_num}")
+        self.stats.count("sweeps", iter_num + 1)
+        self.stats.count("backups", (iter_num + 1) * len(compiled))
+        self.set_node_values(values)
+
     def value(self, state, policy=None):
         if not policy:
             policy = self.policy
+        number = self.number
         probabilities = state.edges
         expected_utility = 0
         if state.is_decision():
             action = policy[state.name]
             edges = list(state.edges.keys())
-            probabilities = {e: state.success_rate if e == action else Decimal((1 - state.success_rate) / (len(edges) - 1)) for e in edges}
+            probabilities = {e: state.success_rate if e == action else number((1 - state.success_rate) / (len(edges) - 1)) for e in edges}
         for node_name, prob in probabilities.items():
-            expected_utility += Decimal(self.df) * Decimal(prob) * self[node_name].value
-        return Decimal(state.reward) + expected_utility
+            expected_utility += number(self.df) * number(prob) * self[node_name].value
+        return number(state.reward) + expected_utility
 
-    def print_solution(self):
-        """Prints solution in the format required for the assignment. It also displays the values in alphabetical order"""
-        print(self.policy.__str__())
+    def solution_text(self):
+        """The solution in the format required for the assignment, with the values in alphabetical order"""
         values = []
         for node_name in sorted(list(self.keys())):
             values.append(f"{node_name}={'%.3f' % round(self[node_name].value, 3)}")
-        print(" ".join(values))
+        return f"{self.policy.__str__()}\n{' '.join(values)}\n"
+
+    def print_solution(self):
+        """Prints solution in the format required for the assignment. It also displays the values in alphabetical order"""
+        print(self.solution_text(), end="")
 
     @staticmethod
-    def read_file(file_name, df=1.0, tol=0.01, max_iter=100, use_min=False):
-        mdp_from_file = MDP(df, None, tol, max_iter, use_min)
-        lines = []
-        with open(file_name) as in_file:
-            for line in in_file.readlines():
-                lines.append(line)
-        MDP.parse_input(mdp_from_file, lines=lines)
+    def read_file(file_name, df=1.0, tol=0.01, max_iter=100, use_min=False, backend="sparse", precision="float64",
+                  solver="vi", cache=None, bounds=False, k=20, workers=1):
+        """cache: an optional cache.ModelCache. On a hit the compiled model is loaded instead of parsing the file,
+            on a miss the parsed and compiled model is stored in it"""
+        mdp_from_file = MDP(df, None, tol, max_iter, use_min, backend, precision, solver, bounds, k, workers)
+        if cache is not None:
+            if precision == "decimal":
+                raise ValueError("The model cache needs a float precision")
+            with open(file_name, "rb") as in_file:
+                text = in_file.read()
+            key = cache.key(text, DTYPES[precision])
+            compiled = cache.get(key)
+            if compiled is None:
+                MDP.parse_input(mdp_from_file, lines=text.decode().splitlines())
+                cache.put(key, mdp_from_file.compile())
+            else:
+                with mdp_from_file.stats.timer("load"):
+                    mdp_from_file.load_compiled(compiled)
+        else:
+            lines = []
+            with open(file_name) as in_file:
+                for line in in_file.readlines():
+                    lines.append(line)
+            MDP.parse_input(mdp_from_file, lines=lines)
         mdp_from_file.policy = Policy.random_policy(mdp_from_file)
         mdp_from_file.apply_policy(mdp_from_file.policy)
         return mdp_from_file
 
     @staticmethod
+    def read_stream(file_name, df=1.0, tol=0.01, max_iter=100, use_min=False, backend="sparse", precision="float64",
+                    solver="vi", cache=None, bounds=False, k=20, workers=1):
+        """Like read_file but with the single pass streaming parser ('-' reads standard input, which is never cached).
+            The statistics of the parse are kept in parse_stats, they stay None when the model came from the cache"""
+        if precision == "decimal":
+            raise ValueError("The streaming parser needs a float precision")
+        mdp_from_file = MDP(df, None, tol, max_iter, use_min, backend, precision, solver, bounds, k, workers)
+        key = compiled = stats = None
+        if cache is not None and file_name != "-":
+            key = cache.file_key(file_name, DTYPES[precision])
+            compiled = cache.get(key)
+        if compiled is None:
+            if file_name == "-":
+                compiled, stats = parse_stream(sys.stdin, DTYPES[precision])
+            else:
+                with open(file_name) as in_file:
+                    compiled, stats = parse_stream(in_file, DTYPES[precision])
+            if key is not None:
+                cache.put(key, compiled)
+        with mdp_from_file.stats.timer("load"):
+            mdp_from_file.load_compiled(compiled)
+        mdp_from_file.parse_stats = stats
+        if stats is not None:
+            mdp_from_file.stats.add_time("parse", stats["seconds"])
+        mdp_from_file.policy = Policy.random_policy(mdp_from_file)
+        mdp_from_file.apply_policy(mdp_from_file.policy)
+        return mdp_from_file
+
+    @staticmethod
+    @timed("parse")
     def parse_input(output_mdp, lines=[]):
+        """Parses the lines into Nodes. With the sparse backend the MDP is made compact at the end.
+            A model with '@grid' blocks is compiled by parse_stream instead and loaded (see load_compiled)"""
+        if any(line.startswith("@grid") for line in lines):
+            if output_mdp.precision not in DTYPES:
+                raise ValueError("Grid blocks need a float precision")
+            compiled, _ = parse_stream(lines, DTYPES[output_mdp.precision])
+            output_mdp.load_compiled(compiled)
+            return
+        if output_mdp.state_values is not None:
+            # parse onto full Nodes again
+            dict.update(output_mdp, [(name, node.copy()) for name, node in output_mdp.items()])
+            output_mdp.state_values = None
+        output_mdp.compiled = None
+        number = output_mdp.number
         unclaimed_probability_lines = []
         while True:
             for i, line in enumerate(lines):
                 line = line.replace("\n", '')
                 if comment.match(line) or line == '':
-                    print_d(f"line #{i}: {line} {'EMPTY LINE' if len(line) == 0 else 'COMMENT'}")
+                    print_d("line #%s: %s %s", i, line, 'EMPTY LINE' if len(line) == 0 else 'COMMENT')
                     continue
                 # Figure out what kind of line this line is.
                 elif reward_line.match(line):
-                    print_d(f"line #{i}: {line} REWARD/COST")
-                    node_name, reward_value = tokenize(line)
+                    print_d("line #%s: %s REWARD/COST", i, line)
+                    node_name, reward_value = tokenize(line, number)
                     # if the node is already in the graph, add the reward to the node if not, create a new node
                     if node_name in output_mdp.keys():
-                        output_mdp[node_name].reward = Decimal(reward_value)
+                        output_mdp[node_name].reward = reward_value
                     else:
-                        output_mdp[node_name] = Node(node_name, Decimal(reward_value))
+                        output_mdp[node_name] = Node(node_name, reward_value, val=number(0))
                 elif edge_line.match(line):
-                    print_d(f"line #{i}: {line} EDGE")  # name: [e1, e2, e2]
+                    print_d("line #%s: %s EDGE", i, line)  # name: [e1, e2, e2]
                     node_name, neighbors = tokenize(line)
                     if node_name not in output_mdp.keys():
-                        output_mdp[node_name] = Node(node_name)
-                    output_mdp[node_name].add_edges(neighbors)
+                        output_mdp[node_name] = Node(node_name, number(0), val=number(0))
+                    output_mdp[node_name].add_edges(neighbors, number)
                 elif probability_line.match(line):
-                    print_d(f"line #{i}: {line} PROBABILITIES")
+                    print_d("line #%s: %s PROBABILITIES", i, line)
                     node_name, probabilities = tokenize(line)
                     if node_name not in output_mdp.keys():
                         unclaimed_probability_lines.append(line)
                         continue
                     # Check if we have a decision node.
-                    output_mdp[node_name].add_probabilities(probabilities)
+                    output_mdp[node_name].add_probabilities(probabilities, number)
                 else:
                     print_d("NO MATCH")
             if unclaimed_probability_lines:
@@ -333,12 +1183,20 @@ class MDP(dict):
                 lines = unclaimed_probability_lines
             else:
                 break
-        for k, v in output_mdp.items():
+        MDP.classify_nodes(output_mdp.values())
+        if output_mdp.uses_arrays():
+            output_mdp.compact()
+
+    @staticmethod
+    def classify_nodes(nodes):
+        """Marks the nodes without edges as terminal and the nodes with edges but no probabilities as decision nodes"""
+        nodes = list(nodes)
+        for v in nodes:
             # Look for nodes with no edges. These nodes are terminal nodes.
-            if not output_mdp[k].edges:
-                output_mdp[k].node_class = "terminal"
+            if not v.edges:
+                v.node_class = "terminal"
 
-        for k, v in output_mdp.items():
+        for v in nodes:
             # Look for nodes with edges but no probabilities it is assumed to be a decision node with success_rate=1
             if all(x == 0 for x in v.edges.values()) and not v.is_terminal():
                 if v.node_class != "decision":  # we don't want to mess with the nodes that are already decision nodes but
@@ -413,8 +1271,8 @@ class MDP(dict):
     #         ]
 
 
-if __name__ == '__main__':
-    # Parse the command line arguments
+def argument_parser():
+    """The command line arguments of mdp.py, also used for the per file flags of batch.py"""
     parser = argparse.ArgumentParser(description='Markov Process Solver: A generic markov process solver')
     parser.add_argument('-df', nargs='?', type=float, required=False, default=1.0,
                         help="Discount factor [0, 1] to use on future rewards, defaults to 1.0")
@@ -424,18 +1282,90 @@ if __name__ == '__main__':
                         help='Tolerance for exiting value iteration, defaults to 0.01')
     parser.add_argument('-iter', nargs='?', default=100, type=float, required=False,
                         help='Integer that indicates a cutoff for value iteration, defaults to 100')
+    parser.add_argument('-precision', required=False, default='float64', choices=list(PRECISIONS),
+                        help='numeric precision for rewards, probabilities and values, defaults to float64. '
+                             'decimal is exact but much slower')
+    parser.add_argument('-solver', required=False, default='vi', choices=list(SOLVERS),
+                        help='vi alternates value iteration and greedy improvement, pi is policy iteration with '
+                             'exact policy evaluation, ps is prioritized sweeping, scc solves the strongly '
+                             'connected components one at a time and mpi is modified policy iteration with -k '
+                             'evaluation sweeps per improvement. Defaults to vi')
+    parser.add_argument('-k', type=int, required=False, default=20,
+                        help='evaluation sweeps after every improvement of -solver mpi, 0 is value iteration and '
+                             'larger values get closer to policy iteration. Defaults to 20')
+    parser.add_argument('-workers', type=int, required=False, default=1,
+                        help='processes that run the sweeps and greedy backups of vi, pi and mpi, each on a block of '
+                             'states with about the same number of transitions. Defaults to 1')
+    parser.add_argument('-bounds', required=False, action='store_true',
+                        help='with vi, pi or mpi and -df below 1, stop as soon as the MacQueen bounds on the optimal values '
+                             'prove the policy optimal or are within -tol of each other, dropping the actions they '
+                             'rule out along the way')
+    parser.add_argument('-stream', required=False, action='store_true',
+                        help="read the input with the single pass streaming parser and print the parse throughput "
+                             "to stderr. With this flag the filename '-' reads standard input")
+    parser.add_argument('-cache', required=False, metavar='DIR',
+                        help='directory of compiled models keyed by a hash of the input, repeated solves of the same '
+                             'file skip parsing')
+    parser.add_argument('-cache_mb', nargs='?', type=float, required=False,
+                        help='evict the least recently used cache entries past this many MB')
+    parser.add_argument('-cache_days', nargs='?', type=float, required=False,
+                        help='evict cache entries that were not used for this many days')
+    parser.add_argument('-sweep', nargs='+', type=float, required=False, metavar='DF',
+                        help='solve the model for each of these discount factors at once and print a table of the '
+                             'policies and values, -df is ignored')
+    parser.add_argument('-sweep_min', required=False, action='store_true',
+                        help='with -sweep, solve every discount factor both maximizing and minimizing')
+    parser.add_argument('-save', required=False, metavar='FILE',
+                        help='also write the solution to FILE, a memory mapped file of the values and the policy '
+                             'sorted by state for fast lookups (see solutions.py)')
+    parser.add_argument('-profile', '--profile', required=False, action='store_true',
+                        help='print the time spent in each phase and the work counters of the solve to stderr')
     parser.add_argument('-d', required=False, action='store_true',
                         help='flag for debugging. It prints the attributes of the nodes before and after solving the MDP')
     parser.add_argument('-t', required=False, action='store_true',
                         help='flag for running a flask app that displays a graph for the MDP')
     parser.add_argument('filename', help='Input file')
-    args = parser.parse_args(sys.argv[1:])
+    return parser
+
+
+def read_args(args):
+    """Reads the model named by parsed command line arguments"""
+    cache = None
+    if args.cache:
+        from cache import ModelCache
+        cache = ModelCache(args.cache, max_bytes=args.cache_mb * 1e6 if args.cache_mb else None,
+                           max_age=args.cache_days * 86400 if args.cache_days else None)
+    read = MDP.read_stream if args.stream else MDP.read_file
+    return read(args.filename, df=args.df, tol=args.tol, max_iter=args.iter, use_min=args.min,
+                precision=args.precision, solver=args.solver, cache=cache, bounds=args.bounds, k=args.k,
+                workers=args.workers)
+
+
+if __name__ == '__main__':
+    # Parse the command line arguments
+    args = argument_parser().parse_args(sys.argv[1:])
     debug = args.d
 
     # Create the MDP and solve it.
-    mdp = MDP.read_file(args.filename, df=args.df, tol=args.tol, max_iter=args.iter, use_min=args.min)
-    mdp.solve()
-    mdp.print_solution()
+    mdp = read_args(args)
+    if args.stream and mdp.parse_stats:
+        stats = mdp.parse_stats
+        print(f"Parsed {stats['lines']} lines ({stats['chars'] / 1e6:.1f} MB) into {stats['states']} states and "
+              f"{stats['transitions']} transitions in {stats['seconds']:.3f}s "
+              f"({stats['lines_per_second']:,.0f} lines/s)", file=sys.stderr)
+    if args.sweep:
+        MDP.print_sweep(mdp.sweep_parameters(args.sweep, (False, True) if args.sweep_min else (args.min,)))
+    else:
+        mdp.solve()
+        mdp.print_solution()
+        if args.save:
+            from solutions import write_solution
+            write_solution(mdp, args.save, source=args.filename)
+        if not mdp.converged:
+            gap = "" if mdp.gap is None else f", bound gap {mdp.gap:.6g}"
+            print(f"Warning: the solve stopped before converging (-iter {mdp.max_iter:g}){gap}", file=sys.stderr)
+    if args.profile:
+        print(mdp.stats, file=sys.stderr)
     # if args.t:
     #     import dash
     #     import dash_cytoscape as cyto
@@ -0,0 +1,151 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from scipy import sparse
+
+
+def partition(compiled, blocks):
+    """Splits the states into at most `blocks` ranges of consecutive ids with about the same work: the transitions
+        of all their rows plus one per state. Returns the boundaries, an array that starts at 0 and ends at the
+        number of states, without empty ranges"""
+    n = len(compiled)
+    work = compiled.transitions.indptr[compiled.action_ptr] + np.arange(n + 1)
+    cuts = np.searchsorted(work, work[-1] * np.arange(1, blocks) / blocks)
+    return np.unique(np.concatenate([[0], cuts, [n]]))
+
+
+def share(array):
+    """Copies an array into a new shared memory block. Returns the block and what attach needs to map it"""
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, memory.buf)[...] = array
+    return memory, (memory.name, array.shape, array.dtype.str)
+
+
+def attach(spec):
+    name, shape, dtype = spec
+    memory = shared_memory.SharedMemory(name=name)
+    return memory, np.ndarray(shape, dtype, memory.buf)
+
+
+def block_worker(specs, lo, hi, connection):
+    """Runs the commands of a SweepPool for the states lo to hi, reading and writing the shared arrays.
+        Every command is answered once it is done, which is the only synchronization"""
+    memories, arrays = zip(*(attach(spec) for spec in specs))
+    rewards, row_state, action_ptr, indptr, indices, data, values, rows, best = arrays
+    first, last = action_ptr[lo], action_ptr[hi]
+    # the rows of the actions of the block, with a column for every state
+    table = sparse.csr_matrix((data[indptr[first]:indptr[last]], indices[indptr[first]:indptr[last]],
+                               indptr[first:last + 1] - indptr[first]), shape=(last - first, len(rewards)))
+    starts = action_ptr[lo:hi] - first
+    local_state = row_state[first:last] - lo
+    row_rewards = rewards[row_state[first:last]]
+    policy_matrix = None
+    while True:
+        command = connection.recv()
+        if command is None:
+            break
+        name, df, src, use_min, keep_current = command
+        df = rewards.dtype.type(df)
+        if name == "rows":
+            policy_matrix = table[rows[lo:hi] - first]
+            connection.send(None)
+        elif name == "sweep":
+            new_values = rewards[lo:hi] + df * (policy_matrix @ values[src])
+            delta = np.max(np.abs(new_values - values[src, lo:hi]), initial=0)
+            values[1 - src, lo:hi] = new_values
+            connection.send(float(delta))
+        elif name == "greedy":
+            # CompiledMDP.greedy on the rows of the block
+            q = row_rewards + df * (table @ values[src])
+            block_best = (np.minimum if use_min else np.maximum).reduceat(q, starts)
+            is_best = q == block_best[local_state]
+            choice = np.minimum.reduceat(np.where(is_best, np.arange(len(q)), len(q)), starts)
+            if keep_current:
+                current = rows[lo:hi] - first
+                choice = np.where(is_best[current], current, choice)
+            rows[lo:hi] = choice + first
+            best[lo:hi] = block_best
+            connection.send(None)
+    del table, policy_matrix, arrays, rewards, row_state, action_ptr, indptr, indices, data, values, rows, best
+    for memory in memories:
+        memory.close()
+
+
+class SweepPool:
+    """Worker processes that run the sweeps and the greedy backups of a CompiledMDP in parallel, each on a block of
+        states with about the same number of transitions. The CSR arrays, the rewards, two value vectors (the sweeps
+        read one and write the other), the policy rows and the best Q values are in shared memory, so only short
+        commands go through the pipes, once per sweep. value_iteration and greedy have the signatures (and results)
+        of the CompiledMDP methods. Use it as a context manager, or call close"""
+
+    def __init__(self, compiled, workers):
+        self.compiled = compiled
+        transitions, n = compiled.transitions, len(compiled)
+        self.memories, specs = zip(*(share(array) for array in (
+            compiled.rewards, compiled.row_state, compiled.action_ptr, transitions.indptr, transitions.indices,
+            transitions.data, np.zeros((2, n), dtype=compiled.dtype), np.zeros(n, dtype=np.int64),
+            np.zeros(n, dtype=compiled.dtype))))
+        self.values, self.rows, self.best = (np.ndarray(shape, dtype, memory.buf)
+                                             for memory, (_, shape, dtype) in zip(self.memories[6:], specs[6:]))
+        self.blocks = partition(compiled, workers)
+        context = multiprocessing.get_context()
+        self.connections, self.processes = [], []
+        for lo, hi in zip(self.blocks[:-1].tolist(), self.blocks[1:].tolist()):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=block_worker, args=(specs, lo, hi, worker_connection), daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self, name, df=0.0, src=0, use_min=False, keep_current=False):
+        """Sends a command to every worker and waits for all of them, returns their answers"""
+        for connection in self.connections:
+            connection.send((name, df, src, use_min, keep_current))
+        return [connection.recv() for connection in self.connections]
+
+    def value_iteration(self, rows, values, df, tol, max_iter):
+        """CompiledMDP.value_iteration in parallel, Jacobi sweeps v = r + df * P_pi v until no value moves by more
+            than tol or max_iter is reached. Returns the new values and the number of the last sweep"""
+        self.rows[:] = rows
+        self.values[0] = values
+        self.run("rows")
+        src, iter_num = 0, 0
+        while True:
+            delta = max(self.run("sweep", df, src))
+            src = 1 - src
+            if delta <= tol or iter_num >= max_iter:
+                break
+            iter_num += 1
+        return self.values[src].copy(), iter_num
+
+    def greedy(self, values, df, use_min=False, current=None):
+        """CompiledMDP.greedy in parallel, the greedy rows and the Bellman backup of the values"""
+        self.values[0] = values
+        if current is not None:
+            self.rows[:] = current
+        self.run("greedy", df, 0, use_min, current is not None)
+        return self.rows.copy(), self.best.copy()
+
+    def close(self):
+        """Stops the workers and frees the shared memory"""
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections, self.processes = [], []
+        self.values = self.rows = self.best = None
+        for memory in self.memories:
+            memory.close()
+            memory.unlink()
+        self.memories = ()
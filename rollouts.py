@@ -0,0 +1,149 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from compiled import TERMINAL
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class Rollouts:
+    """Monte Carlo episodes of a policy on a CompiledMDP, many in lockstep with one vectorized step for all of them.
+        An episode collects the reward of every state it visits, discounted by df per step, and ends in a terminal
+        node, when the row of its state loses probability (the missing mass is the chance of ending there) or after
+        horizon steps. So the mean return of the episodes from a state estimates its value under the policy.
+        The next states of a step are drawn with a single binary search: the key of entry k of row r is r plus the
+        probabilities of the row up to k, so a uniform draw u in [0, 1) of an episode in state r picks the first entry
+        whose key is above r + u, or none when u is past the probabilities of the row"""
+
+    def __init__(self, compiled, rows, df=1.0):
+        self.compiled = compiled
+        matrix = compiled.transitions[rows]
+        matrix.sum_duplicates()
+        self.indptr, self.indices = matrix.indptr, matrix.indices
+        row_of_entry = np.repeat(np.arange(len(compiled), dtype=np.float64), np.diff(matrix.indptr))
+        total = np.concatenate([[0.0], np.cumsum(matrix.data, dtype=np.float64)])
+        within_row = total[1:] - np.repeat(total[matrix.indptr[:-1]], np.diff(matrix.indptr))
+        self.keys = row_of_entry + within_row
+        self.rewards = compiled.rewards.astype(np.float64)
+        self.terminal = compiled.node_class == TERMINAL
+        self.df = float(df)
+
+    def step(self, states, rng):
+        """The next state of every episode in states, -1 where the episode ends"""
+        picks = np.searchsorted(self.keys, states + rng.random(len(states)), side="right")
+        # rounding can leave the last key of the row before a little above r
+        picks = np.maximum(picks, self.indptr[states])
+        return np.where(picks < self.indptr[states + 1], self.indices[np.minimum(picks, len(self.indices) - 1)], -1)
+
+    def run(self, starts, horizon, rng, paths=False):
+        """Simulates one episode from each of the start ids for at most horizon steps. Returns the returns, the
+            hitting times (the step at which the episode was in a terminal node, -1 if never) and with paths the
+            visited states as a (steps, episodes) array, -1 after the end of each episode"""
+        count = len(starts)
+        returns = np.zeros(count)
+        hitting = np.full(count, -1, dtype=np.int64)
+        active = np.arange(count)
+        states = np.asarray(starts, dtype=np.int64)
+        discount = 1.0
+        visited = []
+        for t in range(horizon + 1):
+            if paths:
+                column = np.full(count, -1, dtype=np.int64)
+                column[active] = states
+                visited.append(column)
+            returns[active] += discount * self.rewards[states]
+            hitting[active[self.terminal[states]]] = t
+            if t == horizon:
+                break
+            states = self.step(states, rng)
+            going = states >= 0
+            active, states = active[going], states[going]
+            if not len(active):
+                break
+            discount *= self.df
+        return returns, hitting, np.array(visited) if paths else None
+
+    def simulate(self, starts, episodes, horizon=1000, seed=None, trajectories=None, batch_size=100000):
+        """Runs `episodes` episodes from every start state (a list of ids), batch_size episodes at a time so memory
+            stays bounded. trajectories is an optional text file the episodes are written to as they are simulated,
+            one JSON line each with its start, return, hitting_time and states. The same seed and batch_size give
+            the same episodes. Returns the statistics of each start state, see statistics"""
+        rng = np.random.default_rng(seed)
+        names = self.compiled.names
+        results = []
+        for start in starts:
+            returns, hitting = np.empty(episodes), np.empty(episodes, dtype=np.int64)
+            for offset in range(0, episodes, batch_size):
+                size = min(batch_size, episodes - offset)
+                batch = self.run(np.full(size, start), horizon, rng, trajectories is not None)
+                returns[offset:offset + size], hitting[offset:offset + size], visited = batch
+                if trajectories is not None:
+                    for episode, (value, hit, path) in enumerate(zip(batch[0].tolist(), batch[1].tolist(),
+                                                                     visited.T.tolist())):
+                        trajectories.write(json.dumps({"episode": offset + episode, "start": names[start],
+                                                       "return": value, "hitting_time": hit,
+                                                       "states": [names[s] for s in path if s >= 0]}) + "\n")
+            results.append(statistics(names[start], returns, hitting))
+        return results
+
+
+def statistics(start, returns, hitting):
+    """Return and hitting time statistics of the episodes from a start state"""
+    hit = hitting[hitting >= 0]
+    return {"start": start, "episodes": len(returns), "mean": float(np.mean(returns)),
+            "std": float(np.std(returns)), "stderr": float(np.std(returns) / np.sqrt(len(returns))),
+            "min": float(np.min(returns)), "max": float(np.max(returns)),
+            "percentiles": dict(zip(PERCENTILES, np.percentile(returns, PERCENTILES).tolist())),
+            "hit_rate": len(hit) / len(returns),
+            "hitting_time": {"mean": float(np.mean(hit)),
+                             "percentiles": dict(zip(PERCENTILES, np.percentile(hit, PERCENTILES).tolist()))}
+            if len(hit) else None}
+
+
+def rollouts(mdp, starts=None, episodes=1000, horizon=1000, seed=None, trajectories=None, batch_size=100000):
+    """Simulates the policy of a solved (or any) MDP, `episodes` episodes from every start state (names, all the
+        states when None). See Rollouts.simulate"""
+    compiled = mdp.compiled or mdp.compile()
+    ids = [compiled.index[name] for name in starts] if starts is not None else range(len(compiled))
+    engine = Rollouts(compiled, compiled.policy_rows(mdp.policy), float(mdp.df))
+    return engine.simulate(ids, episodes, horizon, seed, trajectories, batch_size)
+
+
+if __name__ == '__main__':
+    from mdp import argument_parser, read_args
+    parser = argparse.ArgumentParser(description='Solves a model like mdp.py, then simulates episodes of its policy. '
+                                                 'Arguments not listed here are passed on to mdp.py',
+                                     epilog='example: python3 rollouts.py -start A -episodes 100000 -df 0.9 model.txt',
+                                     allow_abbrev=False)
+    parser.add_argument('-start', nargs='+', required=True, help='start states')
+    parser.add_argument('-episodes', type=int, default=10000, help='episodes per start state, defaults to 10000')
+    parser.add_argument('-horizon', type=int, default=1000, help='steps before an episode is cut, defaults to 1000')
+    parser.add_argument('-seed', type=int, help='seed of the random generator, random when not given')
+    parser.add_argument('-trajectories', metavar='FILE', help='write every episode to FILE as a JSON line')
+    args, rest = parser.parse_known_args(sys.argv[1:])
+    mdp = read_args(argument_parser().parse_args(rest))
+    mdp.solve()
+    unknown = [state for state in args.start if state not in mdp]
+    if unknown:
+        parser.error(f"unknown start states: {', '.join(unknown)}")
+    start_time = time.perf_counter()
+    if args.trajectories:
+        with open(args.trajectories, 'w') as out_file:
+            results = rollouts(mdp, args.start, args.episodes, args.horizon, args.seed, out_file)
+    else:
+        results = rollouts(mdp, args.start, args.episodes, args.horizon, args.seed)
+    seconds = time.perf_counter() - start_time
+    for result in results:
+        value = float(mdp[result["start"]].value)
+        print(f"{result['start']}: value {value:.3f}, mean return {result['mean']:.3f} ± {result['stderr']:.3f} "
+              f"(std {result['std']:.3f}, min {result['min']:.3f}, max {result['max']:.3f})")
+        print("  return percentiles: " + ", ".join(f"p{p} {v:.3f}" for p, v in result["percentiles"].items()))
+        if result["hitting_time"]:
+            times = result["hitting_time"]
+            print(f"  terminal reached in {result['hit_rate']:.1%} of the episodes, after {times['mean']:.1f} steps "
+                  "on average (" + ", ".join(f"p{p} {v:g}" for p, v in times["percentiles"].items()) + ")")
+        else:
+            print("  no episode reached a terminal node")
+    print(f"{args.episodes * len(args.start)} episodes in {seconds:.3f}s", file=sys.stderr)
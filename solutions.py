@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+from compiled import DECISION
+
+# a solution file is MAGIC, the length of a JSON header as 8 bytes, the header and then the arrays listed in it, each
+# at a multiple of 8 bytes. The states are sorted by name (as UTF-8 bytes), so a state is found by binary search
+MAGIC = b"MDPSOL01"
+ALIGN = 8
+
+
+def write_solution(mdp, path, **meta):
+    """Writes the values and the policy of a solved MDP to a solution file, with its solve parameters and any meta as
+        the header. The file is written next to path and then moved over it, so readers never see a partial file"""
+    compiled = mdp.compiled or mdp.compile()
+    names = np.array([name.encode() for name in compiled.names], dtype=bytes)
+    order = np.argsort(names, kind="stable")
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    rows = compiled.policy_rows(mdp.policy)
+    targets = compiled.action_target[rows]
+    actions = np.where((compiled.node_class == DECISION) & (targets >= 0), position[np.maximum(targets, 0)], -1)
+    arrays = {"names": names[order], "values": mdp.node_values().astype(np.float64)[order],
+              "actions": actions[order].astype(np.int64)}
+    header = {"states": len(order), "df": float(mdp.df), "use_min": mdp.use_min, "solver": mdp.solver,
+              "converged": mdp.converged, "gap": mdp.gap, **meta, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    text = json.dumps(header).encode()
+    text += b" " * (-(len(MAGIC) + 8 + len(text)) % ALIGN)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as out_file:
+        out_file.write(MAGIC + len(text).to_bytes(8, "little") + text)
+        for array in arrays.values():
+            out_file.write(array.tobytes())
+            out_file.write(b"\0" * (-array.nbytes % ALIGN))
+    os.replace(temporary, path)
+
+
+class SolutionFile:
+    """A solution file opened for lookups. The arrays are memory mapped, so opening it reads only the header and a
+        lookup touches a few pages of the names, whatever the size of the model.
+        meta holds the header: the number of states, df, use_min, solver, converged, gap and the meta of
+        write_solution"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as in_file:
+            if in_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a solution file")
+            length = int.from_bytes(in_file.read(8), "little")
+            self.meta = json.loads(in_file.read(length))
+        start = len(MAGIC) + 8 + length
+        arrays = {name: np.memmap(path, dtype=spec["dtype"], mode="r", offset=start + spec["offset"],
+                                  shape=tuple(spec["shape"])) if spec["shape"][0] else np.zeros(0, spec["dtype"])
+                  for name, spec in self.meta.pop("arrays").items()}
+        self.names, self.values, self.actions = arrays["names"], arrays["values"], arrays["actions"]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, state):
+        return self.find(state) >= 0
+
+    def find(self, state):
+        """Position of a state in the file, -1 when it isn't there"""
+        key = state.encode()
+        i = int(np.searchsorted(self.names, key))
+        return i if i < len(self.names) and self.names[i] == key else -1
+
+    def find_all(self, states):
+        """Positions of many states at once, -1 for the ones that aren't there"""
+        keys = np.array([state.encode() for state in states], dtype=bytes)
+        if not len(keys) or not len(self.names):
+            return np.full(len(keys), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(self.names, keys), len(self.names) - 1)
+        return np.where(self.names[found] == keys, found, -1)
+
+    def get_value(self, state):
+        """The value of a state, raises KeyError when it isn't in the solution"""
+        i = self.find(state)
+        if i < 0:
+            raise KeyError(state)
+        return float(self.values[i])
+
+    def get_action(self, state):
+        """The action the policy takes in a state, None for chance and terminal nodes. Raises KeyError when the state
+            isn't in the solution"""
+        i = self.find(state)
+        if i < 0:
+            raise KeyError(state)
+        action = int(self.actions[i])
+        return self.names[action].decode() if action >= 0 else None
+
+    def get_values(self, states):
+        """The values of many states, None for the ones that aren't in the solution"""
+        return [entry and entry["value"] for entry in self.lookup(states)]
+
+    def get_actions(self, states):
+        """The actions of many states, None for the ones that aren't in the solution or have no action"""
+        return [entry and entry["action"] for entry in self.lookup(states)]
+
+    def lookup(self, states):
+        """{'action', 'value'} of every state, None for the ones that aren't in the solution"""
+        found = self.find_all(states)
+        values = self.values[np.maximum(found, 0)].tolist() if len(self.names) else [None] * len(found)
+        actions = self.actions[np.maximum(found, 0)].tolist() if len(self.names) else [-1] * len(found)
+        return [None if i < 0 else {"action": self.names[action].decode() if action >= 0 else None, "value": value}
+                for i, value, action in zip(found.tolist(), values, actions)]
+
+    def close(self):
+        self.names = self.values = self.actions = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Looks up states in a solution file written by mdp.py -save')
+    parser.add_argument('file', help='solution file')
+    parser.add_argument('states', nargs='*', help='states to look up, all of them when none are given')
+    args = parser.parse_args(sys.argv[1:])
+    solution = SolutionFile(args.file)
+    states = args.states or [name.decode() for name in solution.names]
+    for state, entry in zip(states, solution.lookup(states)):
+        if entry is None:
+            print(f"{state}: unknown state")
+        elif entry["action"] is None:
+            print(f"{state}: value {entry['value']:.3f}")
+        else:
+            print(f"{state} -> {entry['action']}: value {entry['value']:.3f}")
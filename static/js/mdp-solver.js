@@ -4,6 +4,7 @@ class MDPSolver {
     constructor() {
         this.resetMDPData();
         this.currentResults = null;
+        this.streamId = null;
         
         this.initializeEventListeners();
         this.initializeTooltips();
@@ -47,6 +48,7 @@ class MDPSolver {
 
         // Action buttons
         document.getElementById('solveBtn').addEventListener('click', () => this.solveMDP());
+        document.getElementById('stopBtn').addEventListener('click', () => this.stopSolve());
         document.getElementById('validateBtn').addEventListener('click', () => this.validateMDP());
         document.getElementById('clearBtn').addEventListener('click', () => this.clearAll());
 
@@ -79,22 +81,102 @@ class MDPSolver {
                 ...this.getConfiguration()
             };
 
-            const result = await this.makeRequest('/api/solve', {
+            // The streaming endpoint reports every improvement round before the result
+            document.getElementById('solveBtn').disabled = true;
+            const response = await fetch('/api/solve/stream', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(requestData)
             });
+            this.streamId = response.headers.get('X-Stream-Id');
+            this.setSolving(true);
 
-            this.handleSolveResult(result);
+            await this.readEvents(response, (name, data) => {
+                if (name === 'progress') {
+                    this.showProgress(data);
+                } else {
+                    this.handleSolveResult(data);
+                }
+            });
         } catch (error) {
             this.showAlert(`Network error: ${error.message}`, 'danger');
             console.error('Network error:', error);
+        } finally {
+            this.streamId = null;
+            this.setSolving(false);
+        }
+    }
+
+    // Stop the running solve after its current round, the stream still ends with the result so far
+    async stopSolve() {
+        if (!this.streamId) {
+            return;
+        }
+        document.getElementById('stopBtn').disabled = true;
+        try {
+            await this.makeRequest(`/api/solve/stream/${this.streamId}/stop`);
+        } catch (error) {
+            console.error('Stop error:', error);
+        }
+    }
+
+    // Only one solve runs at a time, the stop button is enabled while it does
+    setSolving(solving) {
+        document.getElementById('solveBtn').disabled = solving;
+        document.getElementById('stopBtn').disabled = !solving;
+    }
+
+    // Read the Server-Sent Events of a fetch response, calling onEvent(name, data) for each of them
+    async readEvents(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(event => {
+                let name = 'message';
+                let data = '';
+                event.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) {
+                        name = line.slice(7);
+                    } else if (line.startsWith('data: ')) {
+                        data += line.slice(6);
+                    }
+                });
+                onEvent(name, JSON.parse(data));
+            });
         }
     }
 
+    // Show the progress of a running solve in the solution statistics
+    showProgress(progress) {
+        const residual = progress.residual === null ? 'N/A' : progress.residual.toExponential(2);
+        const text = `Solving... iteration ${progress.iteration}, residual ${residual}, ` +
+            `${progress.policy_changes} policy changes, ${progress.elapsed.toFixed(2)}s`;
+        ['solutionStats', 'solutionStats-mobile'].forEach(id => {
+            const statsElement = document.getElementById(id);
+            if (statsElement) {
+                statsElement.textContent = text;
+            }
+        });
+    }
+
     // Handle the result from MDP solving
     handleSolveResult(result) {
         if (result.success) {
             this.currentResults = result;
-            this.showAlert('MDP solved successfully! Results displayed below.', 'success');
+            if (result.stopped) {
+                this.showAlert('Solve stopped, showing the values and policy so far.', 'info');
+            } else {
+                this.showAlert('MDP solved successfully! Results displayed below.', 'success');
+            }
             this.displayResults(result);
             this.logSolution(result);
         } else {
@@ -110,9 +192,33 @@ class MDPSolver {
         this.populateValuesTable(result.values);
         this.updateSolutionStats(result);
         
-        // Display graph if graph data is available
+        // Display graph if graph data is available, the solve response only links to it
         if (result.graph) {
             this.displayGraph(result.graph);
+        } else if (result.graph_url) {
+            this.loadGraph(result.graph_url);
+        }
+    }
+
+    // Fetch the first page of states of a solution graph and display it, large graphs are not drawn in full
+    async loadGraph(graphUrl) {
+        try {
+            const page = await this.makeRequest(`${graphUrl}?limit=500`, { method: 'GET' });
+            if (!page.success) {
+                console.error('Graph error:', page);
+                return;
+            }
+            // the page has the edges into every state, only draw those between the states of the page
+            const shown = new Set(page.nodes.map(node => node.id));
+            this.displayGraph({
+                nodes: page.nodes,
+                edges: page.edges.filter(edge => shown.has(edge.target))
+            });
+            if (page.next) {
+                this.showAlert(`The graph shows ${page.nodes.length} of ${page.total_nodes} states.`, 'info');
+            }
+        } catch (error) {
+            console.error('Graph error:', error);
         }
     }
 
@@ -221,6 +327,8 @@ class MDPSolver {
         const alertElements = ['solutionStatsAlert', 'solutionStatsAlert-mobile'];
         const iterations = result.iterations || 'N/A';
         const converged = result.converged ? 'Yes' : 'No';
+        const gap = result.gap === null || result.gap === undefined ? '' :
+            ` | Bound gap: <strong>${result.gap.toPrecision(3)}</strong>`;
         
         statsElements.forEach((id, index) => {
             const statsElement = document.getElementById(id);
@@ -232,7 +340,7 @@ class MDPSolver {
                 
                 statsElement.innerHTML = `
                     Iterations: <strong>${iterations}</strong> | 
-                    Converged: <strong>${converged}</strong> | 
+                    Converged: <strong>${converged}</strong>${gap} | 
                     States: <strong>${Object.keys(result.values).length}</strong>
                 `;
             }
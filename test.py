@@ -1,8 +1,16 @@
 import os
+import shutil
+import tempfile
 from itertools import tee
 from decimal import Decimal
 import sys
+import random
 import re
+import numpy as np
+from mdp import MDP
+from generate import grid_block, gridworld, random_graph
+from rollouts import rollouts
+from solutions import SolutionFile, write_solution
 
 in_dir = "./tests/input_files"
 out_dir = "./tests/output_files"
@@ -60,28 +68,238 @@ def compare_values(v1, v2, tolerance):
     return True
 
 
+def solve_and_compare(flags, policy1, values1, tolerance=0.01):
+    """Runs mdp.py with these flags, returns its values when they and the policy match the expected ones"""
+    os.system(f"python3 mdp.py -tol 0.001 {flags} > output_test.txt")
+    with open("output_test.txt") as f2:
+        text_2 = f2.read()
+    values2 = read_values(text_2)
+    if not compare_values(values1, values2, tolerance) or not compare_policies(policy1, read_policy(text_2)):
+        return None
+    return values2
+
+
+def exact_values(input_file, flags, policy):
+    """Values of the expected policy from a direct linear solve, sorted by name like the output of mdp.py"""
+    df = float(re.search(r"-df (\S+)", flags).group(1)) if "-df" in flags else 1.0
+    compiled = MDP.read_file(input_file, df=df, use_min="-min" in flags).compile()
+    values = compiled.evaluate_policy(compiled.policy_rows(policy), np.zeros(len(compiled)), df, 1e-12, 10 ** 6)
+    return {name: Decimal(value) for name, value in sorted(zip(compiled.names, values.tolist()))}
+
+
+def solution(mdp):
+    """The values and the policy of a solved MDP as plain dicts"""
+    return {name: float(node.value) for name, node in mdp.items()}, dict(mdp.policy)
+
+
+def check_incremental_noop():
+    """An edit without model lines (empty or only comments) re-solves nothing and keeps the solution"""
+    mdp = MDP.read_file(f"{in_dir}/input6.txt", df=0.9, tol=0.001)
+    mdp.solve()
+    solved = solution(mdp)
+    for lines in ([], ["", "# only a comment"]):
+        backups = mdp.resolve(lines)
+        if backups != 0 or solution(mdp) != solved:
+            print(f"\tThe edit {lines} changed the solution ({backups} backups)")
+            return False
+    return True
+
+
+def check_workers():
+    """vi, pi and mpi with -workers 2 give exactly the values and the policy of -workers 1"""
+    lines = list(random_graph(2000, random.Random(1)))
+    for solver in ("vi", "pi", "mpi"):
+        solutions = []
+        for workers in (1, 2):
+            mdp = MDP(df=0.95, tol=0.001, solver=solver, workers=workers)
+            MDP.parse_input(mdp, lines=lines)
+            random.seed(0)  # the same random starting policy
+            mdp.solve()
+            solutions.append(solution(mdp))
+        if solutions[0] != solutions[1]:
+            print(f"\tThe solutions of -solver {solver} differ")
+            return False
+    return True
+
+
+def same_solution(a, b, tolerance=1e-9):
+    """Whether two solutions have the same states and policy, and values within tolerance"""
+    return a[0].keys() == b[0].keys() and a[1] == b[1] and all(abs(a[0][k] - b[0][k]) <= tolerance for k in a[0])
+
+
+def check_grid_blocks():
+    """An @grid block has the solution of its expanded text, with walls, terminal cells and 'at' lines"""
+    block = ["@grid rows=2 cols=3 prefix=g success=0.8 reward=-1", "G = 10 terminal", "|.#G", "|...", "@end"]
+    text = ["gx0y0 = -1", "gx0y0 : [gx1y0]", "gx0y0 % 0.8", "gx0y2 = 10",
+            "gx1y0 = -1", "gx1y0 : [gx0y0, gx1y1]", "gx1y0 % 0.8", "gx1y1 = -1", "gx1y1 : [gx1y0, gx1y2]",
+            "gx1y1 % 0.8", "gx1y2 = -1", "gx1y2 : [gx0y2, gx1y1]", "gx1y2 % 0.8"]
+    pairs = [(block, text), (list(grid_block(400, random.Random(3))), list(gridworld(400, random.Random(3))))]
+    for block, text in pairs:
+        solutions = []
+        for lines in (block, text):
+            mdp = MDP(df=0.9, tol=1e-6, solver="pi")
+            MDP.parse_input(mdp, lines=lines)
+            mdp.solve()
+            solutions.append(solution(mdp))
+        if not same_solution(*solutions):
+            print(f"\tThe solution of {block[0]} differs from its text")
+            return False
+    return True
+
+
+def check_solution_file():
+    """A solution file gives back the values and actions of every state, and KeyError or None for unknown states"""
+    mdp = MDP.read_file(f"{in_dir}/input1.txt", df=0.9, tol=0.001)
+    mdp.solve()
+    values, policy = solution(mdp)
+    out_dir = tempfile.mkdtemp()
+    try:
+        write_solution(mdp, os.path.join(out_dir, "input1.sol"))
+        solution_file = SolutionFile(os.path.join(out_dir, "input1.sol"))
+        names = sorted(values)
+        expected_values, expected_actions = [values[name] for name in names], [policy.get(name) for name in names]
+        if (len(solution_file) != len(names) or [solution_file.get_value(name) for name in names] != expected_values
+                or [solution_file.get_action(name) for name in names] != expected_actions
+                or solution_file.get_values(names + ["unknown"]) != expected_values + [None]):
+            print("\tThe solution file doesn't have the solved values and policy")
+            return False
+        for lookup in (solution_file.get_value, solution_file.get_action):
+            try:
+                lookup("unknown")
+            except KeyError:
+                continue
+            print(f"\t{lookup.__name__} of an unknown state didn't raise KeyError")
+            return False
+        solution_file.close()
+    finally:
+        shutil.rmtree(out_dir)
+    return True
+
+
+def check_rollouts():
+    """The mean return of seeded rollouts of the policy is within 4 standard errors of the solved value"""
+    mdp = MDP.read_file(f"{in_dir}/input1.txt", df=0.9, tol=0.0001)
+    mdp.solve()
+    for result in rollouts(mdp, episodes=20000, seed=1):
+        value = float(mdp[result["start"]].value)
+        if abs(result["mean"] - value) > 4 * result["stderr"] + 1e-9:
+            print(f"\tFor node {result['start']}, value={value} mean return={result['mean']} stderr={result['stderr']}")
+            return False
+    return True
+
+
+def check_server():
+    """The web API: a registered model solves like /api/solve, repeats are cache hits, a no-op edit keeps the
+    solution, and the solution cache and the model registry evict the least recently used entries"""
+    import app
+    from cache import LRUCache, ModelStore
+    spill_dir, solution_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    saved = app.solution_cache, app.model_store, app.SOLUTION_DIR
+    app.SOLUTION_DIR = solution_dir
+    client = app.app.test_client()
+    texts = []
+    for i in (1, 6):
+        with open(f"{in_dir}/input{i}.txt") as in_file:
+            texts.append(in_file.read())
+    parameters = {"discount_factor": 0.9, "tolerance": 0.0001, "solver": "pi"}
+    try:
+        # registering a model twice gives the same id, and it solves like /api/solve
+        model_id = client.post("/api/models", json={"text_input": texts[0]}).get_json()["model_id"]
+        if client.post("/api/models", json={"text_input": texts[0]}).get_json()["model_id"] != model_id:
+            print("\tThe same model got two ids")
+            return False
+        stored = client.post(f"/api/models/{model_id}/solve", json=parameters)
+        solved = client.post("/api/solve", json={"text_input": texts[0], **parameters})
+        first, direct = stored.get_json(), solved.get_json()
+        if first["policy"] != direct["policy"] or any(abs(first["values"][k] - direct["values"][k]) > 1e-9
+                                                      for k in direct["values"]):
+            print("\tThe registered model solved differently from /api/solve")
+            return False
+        again = client.post(f"/api/models/{model_id}/solve", json=parameters)
+        caching = stored.headers["X-Cache"], again.headers["X-Cache"]
+        if caching != ("MISS", "HIT") or again.get_json()["values"] != first["values"]:
+            print(f"\tA repeated solve was not a cache hit: {caching}")
+            return False
+        # an edit without model lines doesn"t re-solve anything
+        for changes in ("", "# only a comment"):
+            edited = client.post("/api/solve/incremental", json={"text_input": texts[0], "values": first["values"],
+                                                                 "policy": first["policy"], "changes": changes,
+                                                                 **parameters}).get_json()
+            if not edited["success"] or edited["backups"] != 0 or edited["values"] != first["values"]:
+                print(f"\tThe edit {changes!r} changed the solution: {edited.get('error', edited.get('backups'))}")
+                return False
+        # a solution cache with room for one response drops the first when the second is stored (the sizes vary a
+        # little with the timings in the stats)
+        app.solution_cache = LRUCache(len(solved.data) + 100)
+        responses = [client.post("/api/solve", json={"text_input": text, **parameters}) for text in texts + texts[:1]]
+        if [r.headers["X-Cache"] for r in responses] != ["MISS"] * 3 or not app.solution_cache.stats()["evictions"]:
+            print(f"\tThe solution cache didn't evict: {app.solution_cache.stats()}")
+            return False
+        # a registry with room for one model spills the other to disk and still solves it, without spilling it is gone
+        for spill in (spill_dir, None):
+            app.model_store = ModelStore(1, spill)
+            ids = [client.post("/api/models", json={"text_input": text}).get_json()["model_id"] for text in texts]
+            expected = 200 if spill else 404
+            if client.post(f"/api/models/{ids[0]}/solve", json=parameters).status_code != expected:
+                print(f"\tThe evicted model didn't answer {expected}: {app.model_store.stats()}")
+                return False
+    finally:
+        for written in list(app.pending_solutions.values()):
+            written.wait()
+        app.solution_cache, app.model_store, app.SOLUTION_DIR = saved
+        shutil.rmtree(spill_dir)
+        shutil.rmtree(solution_dir)
+    return True
+
+
+# checks of the python API and the server, each returns whether it passed
+checks = [check_incremental_noop, check_workers, check_grid_blocks, check_solution_file, check_rollouts,
+          check_server]
+
+
 if __name__ == '__main__':
     flags = {3: "-min", 6: "-df 0.9"}
+    # every file is solved in each precision, the results must match the expected policy and each other
+    precisions = ["float64", "float32", "decimal"]
+    # and with every other solver and the streaming parser and the compiled model cache (a miss, then a hit). -bounds
+    # needs df below 1. The values are compared with the exact values of the expected policy
+    cache_dir = tempfile.mkdtemp()
+    variants = ["-solver pi", "-solver ps", "-solver scc", "-solver mpi", "-bounds", "-stream", f"-cache {cache_dir}",
+                f"-cache {cache_dir}"]
     for i in range(1, 7):
         input_file = f"{in_dir}/input{i}.txt"
         output_file = f"{out_dir}/out{i}.txt"
         print(f"Testing file: {input_file}")
-        with open(output_file, 'r') as file:
-            test_out_n = file.read()
-            if i in flags.keys():
-                os.system(f"python3 mdp.py -tol 0.001 {flags[i]} {input_file} > output_test.txt")
-            else:
-                os.system(f"python3 mdp.py -tol 0.001 {input_file} > output_test.txt")
         with open(output_file) as f1:
-            with open("output_test.txt") as f2:
-                text_1 = f1.read()
-                text_2 = f2.read()
-                policy1 = read_policy(text_1)
-                values1 = read_values(text_1)
-                policy2 = read_policy(text_2)
-                values2 = read_values(text_2)
-                if not compare_values(values1, values2, 0.01) or not compare_policies(policy1, policy2):
-                    print("Test Result: Fail")
-                    sys.exit(1)
+            text_1 = f1.read()
+            policy1 = read_policy(text_1)
+        values1 = exact_values(input_file, flags.get(i, ''), policy1)
+        precision_values = {}
+        for precision in precisions:
+            print(f"Precision: {precision}")
+            values2 = solve_and_compare(f"-precision {precision} {flags.get(i, '')} {input_file}", policy1, values1)
+            if values2 is None:
+                print("Test Result: Fail")
+                sys.exit(1)
+            precision_values[precision] = values2
+        for precision in precisions[:-1]:
+            print(f"Comparing {precision} with decimal:")
+            if not compare_values(precision_values["decimal"], precision_values[precision], 0.01):
+                print("Test Result: Fail")
+                sys.exit(1)
+        discounted = "-df" in flags.get(i, '')
+        for variant in variants:
+            if variant == "-bounds" and not discounted:
+                continue
+            print(f"Variant: {variant}")
+            if solve_and_compare(f"{variant} {flags.get(i, '')} {input_file}", policy1, values1) is None:
+                print("Test Result: Fail")
+                sys.exit(1)
+        print("Test Result: Pass")
+    shutil.rmtree(cache_dir)
+    for check in checks:
+        print(f"Checking: {check.__doc__}")
+        if not check():
+            print("Test Result: Fail")
+            sys.exit(1)
         print("Test Result: Pass")
-